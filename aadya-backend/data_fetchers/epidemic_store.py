@@ -0,0 +1,243 @@
+"""
+AADYA Epidemic Findings Store
+Persistent, deduplicated store for crawler findings:
+ - each finding is keyed by a content fingerprint (disease + normalised snippet), so the
+   same article seen again, or via another source, is merged instead of counted twice
+ - indexes by disease, location and day
+ - per-area, per-day trend counters are updated as findings arrive, so epidemic features
+   for an area are a fixed-size lookup instead of a scan over every finding
+ - a crawl journals one record per finding with a sighting count, and the journal is
+   rewritten as one merged record per finding once repeats outnumber findings COMPACT_RATIO
+   to one, so it grows with the findings rather than with crawls × findings
+ - other processes' appends (the crawler) are picked up by tailing the journal from the
+   last byte read, as ActionJournal does
+Kept free of crawler dependencies (spacy, pdfplumber) so the feature builder can import it.
+"""
+
+import os
+import re
+import json
+import hashlib
+import sys
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.file_lock import file_lock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINDINGS_FILE = os.path.join(BASE_DIR, "data_fetchers", "epidemic_findings.jsonl")
+
+TREND_WINDOW_DAYS = 14
+# national / unattributed findings also count towards every area
+SHARED_LOCATIONS = ("india", "unknown")
+# compact the journal once it holds this many records per finding (and at least COMPACT_MIN_LINES)
+COMPACT_RATIO = 4
+COMPACT_MIN_LINES = 1000
+
+
+def _norm(text):
+    return re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).strip()
+
+
+def fingerprint(finding):
+    """Stable content hash of a finding, independent of source and crawl time."""
+    snippet = finding.get("context_snippet") or finding.get("snippet") or ""
+    if snippet.endswith("..."):
+        snippet = snippet[:-3]
+    key = f"{_norm(finding.get('disease'))}|{_norm(snippet)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _day(ts):
+    return (ts or datetime.utcnow().isoformat())[:10]
+
+
+class FindingsStore:
+    def __init__(self, path=FINDINGS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        self.findings = {}        # fingerprint -> merged finding
+        self.by_disease = {}      # disease -> {fingerprint}
+        self.by_location = {}     # location (normalised) -> {fingerprint}
+        self.by_day = {}          # YYYY-MM-DD -> {fingerprint}
+        self.trends = {}          # location -> day -> {"total", "increase", "decrease", "diseases": {..}}
+        self._end = 0             # bytes of the journal already applied
+        self._lines = 0           # journal records applied
+        self._file_id = None      # (inode, device) of the journal, to notice it being compacted
+
+    # ---------- ingest ----------
+    def _index(self, fp, f):
+        loc = _norm(f.get("location")) or "unknown"
+        day = _day(f.get("first_seen"))
+        self.by_disease.setdefault(f.get("disease"), set()).add(fp)
+        self.by_location.setdefault(loc, set()).add(fp)
+        self.by_day.setdefault(day, set()).add(fp)
+        bucket = self.trends.setdefault(loc, {}).setdefault(
+            day, {"total": 0, "increase": 0, "decrease": 0, "diseases": {}})
+        bucket["total"] += 1
+        if f.get("trend") in ("increase", "decrease"):
+            bucket[f["trend"]] += 1
+        bucket["diseases"][f.get("disease")] = bucket["diseases"].get(f.get("disease"), 0) + 1
+
+    def _apply(self, rec):
+        """
+        Apply one journal record: a merged finding written by compaction, or one crawl's
+        sightings of a finding (`count` of them, with the payload the first time).
+        """
+        fp = rec["fingerprint"]
+        if "merged" in rec:
+            self.findings[fp] = dict(rec["merged"])
+            self._index(fp, self.findings[fp])
+            return
+        seen_at = rec.get("seen_at")
+        # records written before sightings were counted carry a single "source"
+        sources = rec.get("sources") or [rec.get("source")]
+        existing = self.findings.get(fp)
+        if existing is None:
+            f = dict(rec["finding"])
+            f.update({"fingerprint": fp, "first_seen": rec.get("first_seen", seen_at), "last_seen": seen_at,
+                      "sources": list(sources), "seen_count": rec.get("count", 1)})
+            self.findings[fp] = f
+            self._index(fp, f)
+            return
+        existing["last_seen"] = max(existing["last_seen"] or "", seen_at or "")
+        existing["seen_count"] += rec.get("count", 1)
+        for source in sources:
+            if source not in existing["sources"]:
+                existing["sources"].append(source)
+
+    def _scan(self):
+        """
+        Apply complete journal lines from self._end to EOF (lines appended by other processes
+        too). A journal replaced by compaction in another process is read again from the start.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._file_id is not None:
+                self._reset()
+            return
+        if (st.st_ino, st.st_dev) != self._file_id or st.st_size < self._end:
+            self._reset()
+            self._file_id = (st.st_ino, st.st_dev)
+        if st.st_size == self._end:
+            return
+        with open(self.path, "rb") as fh:
+            fh.seek(self._end)
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    return  # an append still in flight; read on the next scan
+                self._end += len(line)
+                self._lines += 1
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue  # malformed line
+
+    def refresh(self):
+        """Catch up with findings journaled since the last read (a stat when nothing changed)."""
+        with self._lock:
+            self._scan()
+
+    def _compact(self):
+        """Rewrite the journal as one merged record per finding (caller holds both locks)."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            for fp, f in self.findings.items():
+                fh.write(json.dumps({"fingerprint": fp, "merged": f}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        st = os.stat(self.path)
+        self._file_id, self._end, self._lines = (st.st_ino, st.st_dev), st.st_size, len(self.findings)
+
+    def add_many(self, findings):
+        """Ingest crawler findings; returns only the ones not seen before (by fingerprint)."""
+        with self._lock, file_lock(self.path):
+            self._scan()   # findings journaled by other processes since the last read
+            now = datetime.utcnow().isoformat()
+            batch = {}     # fingerprint -> this crawl's single journal record for it
+            for f in findings:
+                fp = fingerprint(f)
+                seen_at = f.get("timestamp") or now
+                rec = batch.get(fp)
+                if rec is None:
+                    rec = batch[fp] = {"fingerprint": fp, "first_seen": seen_at, "seen_at": seen_at,
+                                       "sources": [], "count": 0}
+                    if fp not in self.findings:
+                        rec["finding"] = f
+                rec["first_seen"] = min(rec["first_seen"], seen_at)
+                rec["seen_at"] = max(rec["seen_at"], seen_at)
+                rec["count"] += 1
+                if f.get("source") not in rec["sources"]:
+                    rec["sources"].append(f.get("source"))
+            if not batch:
+                return []
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write("".join(json.dumps(rec, ensure_ascii=False) + "\n" for rec in batch.values()))
+            self._scan()
+            if self._lines >= max(COMPACT_MIN_LINES, COMPACT_RATIO * len(self.findings)):
+                self._compact()
+            return [self.findings[fp] for fp, rec in batch.items() if "finding" in rec]
+
+    # ---------- queries ----------
+    def query(self, disease=None, location=None, since=None, until=None):
+        """Findings matching every given filter (intersection of the indexes)."""
+        sets = []
+        if disease is not None:
+            sets.append(self.by_disease.get(disease, set()))
+        if location is not None:
+            sets.append(self.by_location.get(_norm(location), set()))
+        if since is not None or until is not None:
+            lo, hi = (since or "0000-00-00")[:10], (until or "9999-99-99")[:10]
+            sets.append(set().union(*[fps for d, fps in self.by_day.items() if lo <= d <= hi]))
+        fps = set.intersection(*sets) if sets else set(self.findings)
+        return [self.findings[fp] for fp in fps]
+
+    def area_features(self, area, days=TREND_WINDOW_DAYS, now=None):
+        """
+        epidemic_flag / epidemic_trend_score / epidemic_types for an area over the last `days`
+        days, summed from the precomputed per-day counters (area + national/unattributed).
+        """
+        today = (now or datetime.utcnow()).date()
+        window = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+        total = increase = 0
+        diseases = set()
+        for loc in {_norm(area)} | set(SHARED_LOCATIONS):
+            per_day = self.trends.get(loc)
+            if not per_day:
+                continue
+            for day in window:
+                b = per_day.get(day)
+                if b:
+                    total += b["total"]
+                    increase += b["increase"]
+                    diseases.update(d for d in b["diseases"] if d)
+        return {
+            "epidemic_flag": 1 if total else 0,
+            "epidemic_trend_score": increase,
+            "epidemic_types": sorted(diseases),
+        }
+
+    def __len__(self):
+        return len(self.findings)
+
+
+_STORE = None
+
+
+def get_store():
+    """
+    Process-wide store, loaded from disk on first use and caught up with the journal on every
+    later call, so a long-running API process sees what a separate crawler process added.
+    """
+    global _STORE
+    if _STORE is None:
+        _STORE = FindingsStore()
+    else:
+        _STORE.refresh()
+    return _STORE
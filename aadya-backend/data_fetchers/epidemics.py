@@ -7,6 +7,8 @@ Exports functions for perception agent integration:
  - crawl_all_sources()
 """
 
+import os
+import sys
 import re
 import requests
 import pdfplumber
@@ -15,6 +17,9 @@ from bs4 import BeautifulSoup
 import spacy
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_fetchers.epidemic_store import get_store
+
 # -------------------------------------------------------
 # Load NLP model
 # -------------------------------------------------------
@@ -168,7 +173,7 @@ NEWS_SOURCES = [
 ]
 
 def crawl_all_sources():
-    """Collects & combines epidemic trend data from all major sources."""
+    """Collects & combines epidemic trend data from all major sources (and files them in the findings store)."""
     all_findings = []
 
     # 1) IDSP bulletin
@@ -182,6 +187,10 @@ def crawl_all_sources():
         findings = detect_disease_trends(text, source=url)
         all_findings.extend(findings)
 
+    # 3) Deduplicate across crawls / sources and update per-area trend counters
+    new = get_store().add_many(all_findings)
+    print(f"[Findings store] {len(new)} new of {len(all_findings)} findings")
+
     return all_findings
 
 
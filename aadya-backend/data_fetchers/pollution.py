@@ -1,15 +1,28 @@
 import requests
 import os
-from datetime import datetime
+import sys
+import csv
+import json
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_fetchers.pollution_latest import (POLLUTION_STORE, LATEST_FILE, CITY_LOCATIONS,
+                                            load_latest, save_latest, update_latest, rebuild_latest)
 # from database.db_config import save_data  # your existing DB saving helper
 
 # Load environment variables
 load_dotenv()
 OPENAQ_KEY = "086c8ba8b0bbf910a2e1f6f088e29dee249923aa0f7b3e6563161127fbba1d1b"
 
-# Base URL for OpenAQ v3 API
-BASE_URL = "https://api.openaq.org/v3/"
+# Base URL for OpenAQ v3 API (override with OPENAQ_BASE_URL to point at a local stub)
+BASE_URL = os.getenv("OPENAQ_BASE_URL", "https://api.openaq.org/v3/")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INGEST_STATE_FILE = os.path.join(BASE_DIR, "pollution_ingest_state.json")
+POLLUTION_STORE_KEYS = ["location_id", "sensor_id", "parameter", "value", "unit", "datetime_from", "datetime_to"]
+SENSOR_CACHE_TTL = timedelta(hours=24)
+PAGE_LIMIT = 1000  # OpenAQ v3 maximum page size
 
 def api_get(endpoint: str, params=None):
     headers = {
@@ -17,7 +30,7 @@ def api_get(endpoint: str, params=None):
         "X-API-Key": OPENAQ_KEY
     }
     try:
-        res = requests.get(f"{BASE_URL}{endpoint}", headers=headers, params=params, timeout=10)
+        res = requests.get(f"{BASE_URL.rstrip('/')}/{endpoint.lstrip('/')}", headers=headers, params=params, timeout=10)
         res.raise_for_status()
         return res.json()
     except requests.exceptions.RequestException as e:
@@ -52,33 +65,155 @@ def get_sensor_measurements(sensor_id: int, period: str = "measurements", limit:
     if not data or "results" not in data:
         return []
 
-    measurements = []
-    for m in data["results"]:
-        measurements.append({
-            "parameter": m.get("parameter", {}).get("name"),
-            "value": m.get("value"),
-            "unit": m.get("parameter", {}).get("units"),
-            "datetime_from": m.get("period", {}).get("datetimeFrom", {}).get("local"),
-            "datetime_to": m.get("period", {}).get("datetimeTo", {}).get("local"),
-            "summary": m.get("summary"),
-            "coverage": m.get("coverage")
-        })
-    return measurements
+    return [_parse_measurement(m) for m in data["results"]]
+
+
+def _parse_measurement(m):
+    period = m.get("period") or {}
+    return {
+        "parameter": (m.get("parameter") or {}).get("name"),
+        "value": m.get("value"),
+        "unit": (m.get("parameter") or {}).get("units"),
+        "datetime_from": (period.get("datetimeFrom") or {}).get("local"),
+        "datetime_to": (period.get("datetimeTo") or {}).get("local"),
+        "datetime_from_utc": (period.get("datetimeFrom") or {}).get("utc"),
+        "datetime_to_utc": (period.get("datetimeTo") or {}).get("utc"),
+        "summary": m.get("summary"),
+        "coverage": m.get("coverage")
+    }
+
+
+# --- Incremental ingestion: cached sensor metadata + per-sensor watermarks ---
+def load_ingest_state(path: str = INGEST_STATE_FILE):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"sensors": {}, "watermarks": {}}
+
+
+def save_ingest_state(state, path: str = INGEST_STATE_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def get_cached_sensors(location_id: int, state):
+    """Sensor list for a location, re-fetched only when the cached copy is older than SENSOR_CACHE_TTL."""
+    cached = state["sensors"].get(str(location_id))
+    if cached and datetime.utcnow() - datetime.fromisoformat(cached["fetched_at"]) < SENSOR_CACHE_TTL:
+        return cached["sensors"]
+    sensors = get_sensors_for_location(location_id)
+    if sensors:
+        state["sensors"][str(location_id)] = {"fetched_at": datetime.utcnow().isoformat(), "sensors": sensors}
+    elif cached:
+        return cached["sensors"]  # keep serving the stale list if the API is down
+    return sensors
+
+
+def iter_new_measurements(sensor_id: int, since=None, period: str = "measurements", page_limit: int = PAGE_LIMIT):
+    """Yield pages of measurements strictly newer than `since` (UTC ISO string), oldest first."""
+    params = {"limit": page_limit, "page": 1}
+    if since:
+        params["datetime_from"] = since
+    while True:
+        data = api_get(f"/sensors/{sensor_id}/{period}", params)
+        if not data or not data.get("results"):
+            return
+        page = [_parse_measurement(m) for m in data["results"]]
+        page = [m for m in page if m["datetime_from_utc"] and (since is None or m["datetime_from_utc"] > since)]
+        if page:
+            yield sorted(page, key=lambda m: m["datetime_from_utc"])
+        if len(data["results"]) < page_limit:
+            return
+        params["page"] += 1
+
+
+def append_to_store(location_id: int, sensor_id: int, measurements, path: str = POLLUTION_STORE):
+    """Append measurements to the store; returns the rows as written."""
+    rows = [{
+        "location_id": location_id,
+        "sensor_id": sensor_id,
+        "parameter": m["parameter"],
+        "value": m["value"],
+        "unit": m["unit"],
+        "datetime_from": m["datetime_from_utc"],
+        "datetime_to": m["datetime_to_utc"],
+    } for m in measurements]
+    write_header = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=POLLUTION_STORE_KEYS)
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def ingest_pollution(location_ids=tuple(CITY_LOCATIONS.values()), period: str = "measurements",
+                     state_path: str = INGEST_STATE_FILE, store_path: str = POLLUTION_STORE,
+                     latest_path: str = LATEST_FILE):
+    """
+    Fetch only readings newer than each sensor's watermark, page through them in bulk
+    and append them to the pollution time-series store. Returns new-row counts per sensor.
+    OpenAQ returns a sensor's readings oldest first, so the watermark is advanced and saved
+    right after each page is written: an interrupted run resumes after the last saved page
+    instead of appending everything again (only a page cut off mid-write can repeat).
+    Each sensor's newest reading is kept in `latest_path` as well (see pollution_latest.py).
+    """
+    state = load_ingest_state(state_path)
+    if os.path.exists(latest_path) or not os.path.exists(store_path):
+        latest = load_latest(latest_path)
+    else:
+        latest = rebuild_latest(store_path)
+        save_latest(latest, latest_path)
+    counts = {}
+    for location_id in location_ids:
+        for sensor in get_cached_sensors(location_id, state):
+            key = f"{sensor['id']}:{period}"
+            since = state["watermarks"].get(key)
+            counts[sensor["id"]] = 0
+            for page in iter_new_measurements(sensor["id"], since, period):
+                # never re-append readings at or before what an earlier page already wrote
+                newest = state["watermarks"].get(key)
+                page = [m for m in page if newest is None or m["datetime_from_utc"] > newest]
+                if not page:
+                    continue
+                for row in append_to_store(location_id, sensor["id"], page, store_path):
+                    update_latest(latest, row)
+                save_latest(latest, latest_path)
+                state["watermarks"][key] = page[-1]["datetime_from_utc"]
+                save_ingest_state(state, state_path)
+                counts[sensor["id"]] += len(page)
+        save_ingest_state(state, state_path)  # refreshed sensor cache
+    print(f"✅ Ingested {sum(counts.values())} new readings from {len(counts)} sensors")
+    return counts
 
 
 # --- Step 3: Combine Everything for a Location ---
 def get_pollution_data(location_id: int = 8118, period: str = "measurements"):
-    sensors = get_sensors_for_location(location_id)
+    # keep every reading in pollution_store.csv; the snapshot carries each sensor's newest one,
+    # taken from what was just ingested rather than downloaded again
+    ingest_pollution([location_id], period)
+    state = load_ingest_state()
+    sensors = get_cached_sensors(location_id, state)
+    save_ingest_state(state)
     if not sensors:
         print("⚠️  No sensors found for this location.")
         return {"status": "no_sensors", "timestamp": datetime.now().isoformat()}
 
+    latest = load_latest()
     pollution_data = []
     for sensor in sensors:
         sensor_id = sensor["id"]
         param = sensor["parameter"]
-        print(f"🔍 Fetching {period} data for sensor {sensor_id} ({param})...")
-        sensor_measurements = get_sensor_measurements(sensor_id, period)
+        row = latest.get(str(sensor_id))
+        sensor_measurements = [] if row is None else [{
+            "parameter": row["parameter"],
+            "value": row["value"],
+            "unit": row["unit"],
+            "datetime_from_utc": row["datetime_from"],
+            "datetime_to_utc": row["datetime_to"],
+        }]
         pollution_data.append({
             "sensor_id": sensor_id,
             "parameter": param,
@@ -99,7 +234,82 @@ def get_pollution_data(location_id: int = 8118, period: str = "measurements"):
     return data
 
 
+def stub_check(n_readings: int = 2500):
+    """
+    Run ingest_pollution against a local OpenAQ stub: the first run fails part-way through,
+    the rerun must resume without duplicates or gaps, and a third run must add nothing.
+    The sensor's latest reading must then be the newest one served.
+    """
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    start = datetime(2026, 1, 1)
+    readings = [(start + timedelta(hours=i)).isoformat() + "Z" for i in range(n_readings)]
+    fail_page = {"page": 3}  # the first request for page 3 fails once
+
+    class Stub(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path.startswith("/locations/"):
+                body = {"results": [{"sensors": [{"id": 1, "parameter": {"name": "pm25"}}]}]}
+            else:
+                page, limit = int(q.get("page", 1)), int(q.get("limit", PAGE_LIMIT))
+                if page == fail_page.get("page"):
+                    fail_page.clear()
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                rows = [t for t in readings if t >= q.get("datetime_from", "")]
+                body = {"results": [
+                    {"value": i, "parameter": {"name": "pm25", "units": "µg/m³"},
+                     "period": {"datetimeFrom": {"utc": t, "local": t}, "datetimeTo": {"utc": t, "local": t}}}
+                    for i, t in enumerate(rows[(page - 1) * limit: page * limit])
+                ]}
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(payload)
+
+    global BASE_URL
+    server = HTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    saved_url, BASE_URL = BASE_URL, f"http://127.0.0.1:{server.server_port}/"
+    tmp = tempfile.mkdtemp()
+    state_path, store_path = os.path.join(tmp, "state.json"), os.path.join(tmp, "store.csv")
+    latest_path = os.path.join(tmp, "latest.json")
+    try:
+        runs = [ingest_pollution([1], "hours", state_path, store_path, latest_path)[1] for _ in range(3)]
+    finally:
+        BASE_URL = saved_url
+        server.shutdown()
+    with open(store_path, newline="") as f:
+        stored = [r["datetime_from"] for r in csv.DictReader(f)]
+    print(f"stub check: new rows per run {runs}, {len(stored)} stored "
+          f"({len(stored) - len(set(stored))} duplicates), {n_readings} served")
+    latest = load_latest(latest_path).get("1", {})
+    rebuilt = rebuild_latest(store_path).get("1", {})
+    print(f"stub check: latest reading {latest.get('datetime_from')} = {latest.get('value')}")
+    return (stored == readings and runs[0] == 2 * PAGE_LIMIT and runs[2] == 0
+            and latest.get("datetime_from") == readings[-1] and rebuilt == latest)
+
+
 if __name__ == "__main__":
+    import sys
+    if "--stub-check" in sys.argv:
+        ok = stub_check()
+        print("✅ Resumed without duplicates or gaps" if ok else "❌ Stub check failed")
+        sys.exit(0 if ok else 1)
+
     # Try different aggregation levels:
     result = get_pollution_data(8118, period="hours")   # hourly average
     print("\nFetched Data Summary:\n", result)
+
+    # Incremental ingestion (run repeatedly; only new readings are fetched)
+    print(ingest_pollution([8118], period="hours"))
@@ -0,0 +1,59 @@
+"""
+pollution_latest.py
+Newest ingested reading per OpenAQ sensor, kept in a small JSON file next to pollution_store.csv.
+ingest_pollution() updates it as it appends pages, so readers get a city's current PM2.5
+without scanning the ever-growing store.
+Kept free of requests / dotenv so the feature builder can import it.
+"""
+import os
+import csv
+import json
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLLUTION_STORE = os.path.join(BASE_DIR, "pollution_store.csv")
+LATEST_FILE = os.path.join(BASE_DIR, "pollution_latest.json")
+
+# OpenAQ location whose sensors stand for each city
+CITY_LOCATIONS = {"Mumbai": 8118}
+
+
+def load_latest(path: str = LATEST_FILE):
+    """sensor_id (str) -> newest stored row (the pollution_store.csv columns), {} if none yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_latest(latest, path: str = LATEST_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(latest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def update_latest(latest, row):
+    """Keep `row` (a pollution_store.csv row) if it is its sensor's newest reading with a value."""
+    if row.get("value") in (None, "") or not row.get("datetime_from"):
+        return
+    key = str(row["sensor_id"])
+    current = latest.get(key)
+    if current is None or row["datetime_from"] >= current["datetime_from"]:
+        latest[key] = {**row, "location_id": int(row["location_id"]), "sensor_id": int(row["sensor_id"]),
+                       "value": float(row["value"])}
+
+
+def rebuild_latest(store_path: str = POLLUTION_STORE):
+    """One pass over pollution_store.csv, for a store written before the latest file existed."""
+    latest = {}
+    if os.path.exists(store_path):
+        with open(store_path, newline="") as f:
+            for row in csv.DictReader(f):
+                update_latest(latest, row)
+    return latest
+
+
+def location_readings(location_id, parameter: str = "pm25", path: str = LATEST_FILE):
+    """Newest stored reading of every sensor at `location_id` measuring `parameter`."""
+    return [r for r in load_latest(path).values()
+            if r["location_id"] == int(location_id) and r["parameter"] == parameter]
@@ -0,0 +1,32 @@
+# backend/gunicorn_conf.py
+# Pre-forked multi-worker serving: models are loaded once in the master, then workers fork
+# and share those pages copy-on-write.
+#   gunicorn -c gunicorn_conf.py main:app
+# Per-worker resident / shared memory: GET /api/memory
+# Workers share the action journal (ids allocated under a file lock); one worker at a time
+# holds the refresher lock and publishes insights for the others (see main.refresh_state).
+import os
+import sys
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+bind = os.getenv("AADYA_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("AADYA_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True   # import main:app (and everything it loads) in the master before forking
+timeout = 120
+
+
+def on_starting(server):
+    from pipeline.model_registry import preload, memory_report
+    # lets workers tell they were forked by this master (see model_registry.server_master)
+    os.environ["AADYA_SERVER_MASTER"] = str(os.getpid())
+    loaded = preload(freeze=True)
+    server.log.info(f"Preloaded {len(loaded)} model artifacts in master: {', '.join(loaded)}")
+    server.log.info(f"Master memory after preload: {memory_report()}")
+
+
+def post_fork(server, worker):
+    from pipeline.model_registry import memory_report
+    server.log.info(f"Worker {worker.pid} forked: {memory_report(worker.pid)}")
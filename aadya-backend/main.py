@@ -1,11 +1,22 @@
 # backend/main.py
 # 100 lines - FastAPI backend for AADYA Admin Dashboard
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Dict, Any, Optional, Literal
 from datetime import datetime, timedelta
-import random, uvicorn, asyncio, os, csv, json
+import random, uvicorn, asyncio, json
+
+from pipeline.history_store import (append_insights, stream_history, publish_latest, read_latest,
+                                    compacted_before, EXPORT_FORMATS, INSIGHTS_LATEST)
+from pipeline.file_lock import try_lock
+from pipeline.action_journal import ActionJournal, DEFAULT_PAGE_SIZE
+from pipeline.state_snapshot import SnapshotStore, InsightRow, utc_now
+from pipeline.scenario_engine import run_scenarios, base_features, MAX_SAMPLES
+from pipeline.feature_store import FEATURE_STORE
+from pipeline.model_registry import workers_memory_report
+from pipeline.compaction import daily_with_lags, SOURCES as ROLLUP_SOURCES
 
 app = FastAPI(title="AADYA Admin API", version="1.0")
 
@@ -16,8 +27,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple in-memory store for demo (replace with DB in prod)
-STATE = {"last_update": None, "insights": [], "features": [], "actions": []}
+# In-memory state for demo (replace with DB in prod), held as immutable snapshots:
+# endpoints read STATE.current without locking, writers publish a new version via STATE.update().
+# Operator actions live in the on-disk journal, shared by every worker.
+STATE = SnapshotStore()
+JOURNAL = ActionJournal()
 
 # Models
 class Insight(BaseModel):
@@ -34,13 +48,35 @@ class ActionRequest(BaseModel):
     action_type: str
     details: Dict[str, Any]
 
+class Perturbation(BaseModel):
+    dist: Literal["uniform", "normal"] = "uniform"   # "uniform" (low, high) or "normal" (mean, std)
+    low: float = 0.0
+    high: float = 0.0
+    mean: float = 0.0
+    std: float = Field(0.0, ge=0)
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.low > self.high:
+            raise ValueError("low must be <= high")
+        return self
+
+class ScenarioRequest(BaseModel):
+    n_samples: int = Field(10000, ge=1, le=MAX_SAMPLES)
+    pm25_shift: Optional[Perturbation] = Perturbation(dist="uniform", low=50, high=120)
+    temp_shift: Optional[Perturbation] = None
+    festival_prob: Optional[float] = Field(None, ge=0, le=1)
+    epidemic_prob: Optional[float] = Field(None, ge=0, le=1)
+    seed: Optional[int] = None
+
 # Utilities - synthetic realistic generator
+# city / hospital_id tie an area to its rows in the feature store and context snapshot
 AREAS = [
-    {"area_id":"MUM_CITY","area_name":"Mumbai City"},
-    {"area_id":"MUM_BANDRA","area_name":"Bandra"},
-    {"area_id":"NAVI_VASHI","area_name":"Navi Vashi"},
-    {"area_id":"KDMC_KALYAN","area_name":"Kalyan"},
-    {"area_id":"THANE","area_name":"Thane"}
+    {"area_id":"MUM_CITY","area_name":"Mumbai City","city":"Mumbai","hospital_id":"HOSP_MUM_001"},
+    {"area_id":"MUM_BANDRA","area_name":"Bandra","city":"Mumbai","hospital_id":"HOSP_MUM_001"},
+    {"area_id":"NAVI_VASHI","area_name":"Navi Vashi","city":"Navi Mumbai","hospital_id":"HOSP_MUM_001"},
+    {"area_id":"KDMC_KALYAN","area_name":"Kalyan","city":"Kalyan","hospital_id":"HOSP_MUM_001"},
+    {"area_id":"THANE","area_name":"Thane","city":"Thane","hospital_id":"HOSP_MUM_001"}
 ]
 
 def gen_insight_row(area):
@@ -49,29 +85,47 @@ def gen_insight_row(area):
     surge = min(100, int((pm25/300)*80 + random.randint(-5,10)))
     expected = int(round(30*(1+surge/100.0)))
     oxygen = max(0, int((expected-30)/10))
-    return {
-        "timestamp": now,
-        "area_id": area["area_id"],
-        "area_name": area["area_name"],
-        "pm25": pm25,
-        "surge_risk": surge,
-        "expected_patients_hr": expected,
-        "oxygen_extra": oxygen
-    }
-
-async def refresh_state_periodically(interval=30):
+    return InsightRow(
+        timestamp=now,
+        area_id=area["area_id"],
+        area_name=area["area_name"],
+        pm25=pm25,
+        surge_risk=surge,
+        expected_patients_hr=expected,
+        oxygen_extra=oxygen
+    )
+
+# With several server workers only one (the holder of the refresher lock) generates insights,
+# appends them to the history and publishes them; the others pick up the published rows.
+_refresher = {"lock": None, "mtime": None}
+
+def refresh_state():
+    if _refresher["lock"] is None:
+        _refresher["lock"] = try_lock(INSIGHTS_LATEST)
+    if _refresher["lock"] is not None:
+        insights = [gen_insight_row(a) for a in AREAS]
+        now = utc_now()
+        STATE.update(lambda s: s.evolve(insights=insights, last_update=now))
+        rows = [r.to_dict() for r in insights]
+        append_insights(rows)
+        publish_latest(rows, now)
+        return
+    _refresher["mtime"], latest = read_latest(_refresher["mtime"])
+    if latest is not None:
+        insights = [InsightRow(**r) for r in latest["insights"]]
+        STATE.update(lambda s: s.evolve(insights=insights, last_update=latest["last_update"]))
+
+async def refresh_state_periodically(interval=30, sync_interval=2):
     while True:
-        STATE["insights"] = [gen_insight_row(a) for a in AREAS]
-        STATE["features"] = [{"area_id":r["area_id"], "pm25":r["pm25"], "temp": round(random.uniform(24,33),1)} for r in STATE["insights"]]
-        STATE["last_update"] = datetime.utcnow().isoformat()+"Z"
-        await asyncio.sleep(interval)
+        refresh_state()
+        await asyncio.sleep(interval if _refresher["lock"] is not None else sync_interval)
 
 @app.on_event("startup")
 async def startup_event():
+    # index operator actions persisted before the restart (drops a torn final write)
+    JOURNAL.replay(tail=0)
     # warm initial state
-    STATE["insights"] = [gen_insight_row(a) for a in AREAS]
-    STATE["features"] = [{"area_id":r["area_id"], "pm25":r["pm25"], "temp": round(random.uniform(24,33),1)} for r in STATE["insights"]]
-    STATE["last_update"] = datetime.utcnow().isoformat()+"Z"
+    refresh_state()
     # background refresher
     loop = asyncio.get_event_loop()
     loop.create_task(refresh_state_periodically())
@@ -81,56 +135,138 @@ async def startup_event():
 def health():
     return {"status":"ok","now": datetime.utcnow().isoformat()+"Z"}
 
+# Resident / shared memory per worker (shared model pages when served via gunicorn_conf.py)
+@app.get("/api/memory")
+def get_memory():
+    return workers_memory_report()
+
 @app.get("/api/insights", response_model=List[Insight])
 def get_insights():
-    return STATE["insights"]
+    return [r.to_dict() for r in STATE.current.insights]
 
+# Features precomputed by the prediction pipeline (latest hour, or one hour from history)
 @app.get("/api/features")
-def get_features():
-    return {"last_update": STATE["last_update"], "features": STATE["features"]}
+def get_features(city: Optional[str] = None,
+                 hospital_id: Optional[str] = None,
+                 department: Optional[str] = None,
+                 hour: Optional[str] = None):
+    if hour is not None:
+        if None in (city, hospital_id, department):
+            raise HTTPException(status_code=400, detail="hour lookups need city, hospital_id and department")
+        try:
+            row = FEATURE_STORE.get(city, hospital_id, department, hour)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if row is None:
+            raise HTTPException(status_code=404, detail="no features stored for that key and hour")
+        return {"last_update": row["hour_ts"], "features": [row]}
+    updated_at, rows = FEATURE_STORE.latest(city=city, hospital_id=hospital_id, department=department)
+    return {"last_update": updated_at, "features": rows}
 
 @app.post("/api/action")
 def post_action(req: ActionRequest):
-    row = {"id": len(STATE["actions"])+1, "timestamp": datetime.utcnow().isoformat()+"Z", "request": req.dict()}
-    STATE["actions"].append(row)
     # Simulate immediate effect: reduce surge slightly for area
-    for r in STATE["insights"]:
-        if r["area_id"] == req.area_id:
-            r["surge_risk"] = max(0, r["surge_risk"] - 8)
-            r["expected_patients_hr"] = max(10, int(r["expected_patients_hr"]*0.92))
+    def relieve(r):
+        return r.replace(surge_risk=max(0, r.surge_risk - 8),
+                         expected_patients_hr=max(10, int(r.expected_patients_hr*0.92)))
+
+    # persist first (write + fsync), outside the snapshot writer lock the refresher also takes
+    row = JOURNAL.append(req.dict())
+    STATE.update(lambda s: s.evolve(insights=s.map_area(req.area_id, relieve)))
     return {"status":"accepted","action_id": row["id"]}
 
 @app.get("/api/actions")
-def list_actions():
-    return {"actions": STATE["actions"]}
+def list_actions(area_id: Optional[str] = None,
+                 since: Optional[str] = None,
+                 until: Optional[str] = None,
+                 cursor: Optional[int] = None,
+                 limit: int = DEFAULT_PAGE_SIZE):
+    # newest first; pass back `next_cursor` to fetch the next (older) page
+    try:
+        return JOURNAL.page(area_id=area_id, since=since, until=until, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/api/simulate/{area_id}")
-def simulate_area(area_id: str):
-    found = False
-    for a in AREAS:
-        if a["area_id"] == area_id:
-            found = True; break
-    if not found:
+def simulate_area(area_id: str, req: Optional[ScenarioRequest] = None):
+    area = next((a for a in AREAS if a["area_id"] == area_id), None)
+    row = next((r for r in STATE.current.insights if r.area_id == area_id), None)
+    if area is None or row is None:
         raise HTTPException(status_code=404, detail="area not found")
-    # bump PM2.5 artificially
-    for r in STATE["insights"]:
-        if r["area_id"] == area_id:
-            r["pm25"] = min(500, r["pm25"] + random.uniform(50,120))
-            r["surge_risk"] = min(100, r["surge_risk"] + random.randint(15,40))
-            r["expected_patients_hr"] = int(round(30*(1+r["surge_risk"]/100.0)))
-    return {"status":"simulated","area_id": area_id}
-
-# Quick CSV export for demo
-@app.get("/api/export/csv")
-def export_csv():
-    path = "insights_export.csv"
-    keys = ["timestamp","area_id","area_name","pm25","surge_risk","expected_patients_hr","oxygen_extra"]
-    with open(path, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=keys)
-        writer.writeheader()
-        for r in STATE["insights"]:
-            writer.writerow({k: r.get(k) for k in keys})
-    return {"csv": os.path.abspath(path)}
+    req = req or ScenarioRequest()
+    base = base_features(city=area["city"], hospital_id=area["hospital_id"])
+    if base.empty:
+        # no pipeline features or snapshot for this area yet: fall back to the heuristic bump
+        def bump(r):
+            pm25 = min(500, r.pm25 + random.uniform(50,120))
+            surge = min(100, r.surge_risk + random.randint(15,40))
+            return r.replace(pm25=pm25, surge_risk=surge,
+                             expected_patients_hr=int(round(30*(1+surge/100.0))))
+        STATE.update(lambda s: s.evolve(insights=s.map_area(area_id, bump)))
+        return {"status":"simulated","area_id": area_id, "scenario": None}
+    # start every sample from the area's current PM2.5 reading
+    base = base.assign(pm25=row.pm25)
+    result = run_scenarios(
+        base,
+        n_samples=req.n_samples,
+        pm25_shift=req.pm25_shift.dict() if req.pm25_shift else None,
+        temp_shift=req.temp_shift.dict() if req.temp_shift else None,
+        festival_prob=req.festival_prob,
+        epidemic_prob=req.epidemic_prob,
+        seed=req.seed,
+    )
+    # publish the median scenario so dashboards reflect the what-if
+    def apply_median(r):
+        pm25 = round(result["pm25"]["p50"], 1)
+        return r.replace(pm25=pm25,
+                         surge_risk=min(100, int((pm25/300)*80)),
+                         expected_patients_hr=int(round(result["forecast"]["p50"])))
+    STATE.update(lambda s: s.evolve(insights=s.map_area(area_id, apply_median)))
+    return {"status":"simulated","area_id": area_id, "scenario": result}
+
+# Daily history across compacted rollups and raw rows, with calendar-day lags and rolling means
+@app.get("/api/history/daily")
+def daily_history(source: str = "timeseries",
+                  value: str = "total_patients",
+                  stat: str = "sum",
+                  city: Optional[str] = None,
+                  hospital_id: Optional[str] = None,
+                  department: Optional[str] = None):
+    if source not in ROLLUP_SOURCES:
+        raise HTTPException(status_code=404, detail=f"unknown source '{source}'")
+    if value not in ROLLUP_SOURCES[source][1] or stat not in ("sum", "mean", "max"):
+        raise HTTPException(status_code=400, detail="unsupported value column or stat")
+    df = daily_with_lags(source, value, stat, city=city, hospital_id=hospital_id, department=department)
+    df["day"] = df["day"].astype(str).str[:10]
+    return {"source": source, "value": value, "stat": stat,
+            "days": json.loads(df.to_json(orient="records"))}
+
+# Streaming history export (csv / ndjson / parquet), filtered by area, time range and columns
+@app.get("/api/export/{fmt}")
+def export_history(fmt: str,
+                   source: str = "insights",
+                   area_id: Optional[str] = None,
+                   start: Optional[str] = None,
+                   end: Optional[str] = None,
+                   columns: Optional[str] = Query(None, description="comma-separated column names")):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"unknown export format '{fmt}'")
+    cols = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    try:
+        body = stream_history(fmt, source=source, area_id=area_id, start=start, end=end, columns=cols)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    filename = f"{source}_export.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    cutoff = compacted_before(source)
+    if cutoff is not None:
+        # older rows only exist as daily rollups (/api/history/daily); flag where raw rows begin
+        headers["X-Compacted-Before"] = cutoff.isoformat()
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[fmt], headers=headers)
 
 # Run if executed directly
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""
+action_journal.py
+Append-only operator action journal (JSON lines) with monotonic ids,
+an in-memory offset index by area_id / time and cursor-paginated reads.
+Safe to share between server worker processes: ids are allocated under a file lock and
+each process indexes the lines the others appended before reading or writing.
+"""
+import os
+import json
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from pipeline.file_lock import file_lock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+ACTIONS_JOURNAL = os.path.join(OUTPUT_DIR, 'actions_journal.jsonl')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _epoch(ts):
+    """ISO timestamp (optionally 'Z'-suffixed) -> UTC epoch seconds."""
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    dt = datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class _Index:
+    """Parallel, append-only id / timestamp / byte-offset lists (ids strictly increasing)."""
+    __slots__ = ("ids", "ts", "offsets")
+
+    def __init__(self):
+        self.ids = []
+        self.ts = []
+        self.offsets = []
+
+    def add(self, action_id, ts, offset):
+        self.ids.append(action_id)
+        self.ts.append(ts)
+        self.offsets.append(offset)
+
+
+class ActionJournal:
+    """
+    Actions are appended to a JSON-lines file and never rewritten.
+    Only byte offsets are kept in memory, so a page read costs O(log n + page size).
+    """
+
+    def __init__(self, path=ACTIONS_JOURNAL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._all = _Index()
+        self._by_area = {}
+        self._next_id = 1
+        self._end = 0          # bytes of the file already indexed
+        self._fh = None
+
+    def _index(self, row, offset):
+        ts = _epoch(row["timestamp"])
+        self._all.add(row["id"], ts, offset)
+        area_id = row.get("request", {}).get("area_id")
+        self._by_area.setdefault(area_id, _Index()).add(row["id"], ts, offset)
+        self._next_id = row["id"] + 1
+
+    def _scan(self):
+        """
+        Index complete lines from self._end to EOF (lines appended by other processes too).
+        Returns the offset of an unterminated final line (never acknowledged), else None.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == self._end:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(self._end)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # an append still in flight, or a torn write at the end of the file
+                    return self._end
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # a corrupt line in the middle: skip it, keep every action after it
+                    print(f"⚠️  Skipping unreadable journal line at byte {self._end}")
+                else:
+                    self._index(row, self._end)
+                self._end += len(line)
+        return None
+
+    def replay(self, tail=100):
+        """Rebuild the index from disk and return the last `tail` actions (oldest first)."""
+        with self._lock, file_lock(self.path):
+            self._all = _Index()
+            self._by_area = {}
+            self._next_id = 1
+            self._end = 0
+            torn_at = self._scan()
+            if torn_at is not None:
+                # torn write at the very end of the file; it was never acknowledged
+                with open(self.path, "r+b") as f:
+                    f.truncate(torn_at)
+            offsets = self._all.offsets[-tail:] if tail else []
+        return self._read(offsets)
+
+    def append(self, request):
+        """
+        Persist one action request and return the stored row. The id is allocated under an
+        inter-process lock after indexing what other server workers appended, so ids stay
+        unique and increasing across workers sharing the file.
+        """
+        with self._lock, file_lock(self.path):
+            if self._fh is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._fh = open(self.path, "ab")
+            self._scan()
+            row = {"id": self._next_id, "timestamp": datetime.utcnow().isoformat()+"Z", "request": request}
+            offset = self._fh.seek(0, os.SEEK_END)
+            line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._index(row, offset)
+            self._end = offset + len(line)
+        return row
+
+    def page(self, area_id=None, since=None, until=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Newest-first page of actions, optionally for one area and within [since, until).
+        `cursor` is the `next_cursor` of the previous page (an action id; older ids follow).
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        with self._lock:
+            self._scan()
+            idx = self._all if area_id is None else self._by_area.get(area_id)
+            if idx is None:
+                return {"actions": [], "next_cursor": None}
+            n = len(idx.ids)
+            lo = bisect_left(idx.ts, _epoch(since), 0, n) if since else 0
+            hi = bisect_left(idx.ts, _epoch(until), 0, n) if until else n
+            if cursor is not None:
+                hi = min(hi, bisect_left(idx.ids, int(cursor), 0, n))
+            start = max(lo, hi - limit)
+            offsets = idx.offsets[start:hi][::-1]
+            next_cursor = idx.ids[start] if start > lo else None
+        return {"actions": self._read(offsets), "next_cursor": next_cursor}
+
+    def _read(self, offsets):
+        if not offsets:
+            return []
+        rows = []
+        with open(self.path, "rb") as f:
+            for off in offsets:
+                f.seek(off)
+                rows.append(json.loads(f.readline()))
+        return rows
+
+    def __len__(self):
+        return len(self._all.ids)
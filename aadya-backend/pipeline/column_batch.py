@@ -0,0 +1,89 @@
+"""
+column_batch.py
+Shared columnar batch passed between pipeline stages.
+Columns are NumPy arrays of equal length; stages read them and add new columns in place,
+and model inputs are wrapped as DataFrames without copying the arrays.
+"""
+import numpy as np
+import pandas as pd
+
+
+class ColumnBatch:
+    __slots__ = ('_cols', '_n')
+
+    def __init__(self, columns=None):
+        self._cols = {}
+        self._n = None
+        for name, values in (columns or {}).items():
+            self[name] = values
+
+    @classmethod
+    def from_frame(cls, df):
+        """Take over a DataFrame's columns as arrays (no copy for numeric columns)."""
+        return cls({c: df[c].to_numpy() for c in df.columns})
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        names = [c for c in batches[0].columns if all(c in b for b in batches)]
+        return cls({c: np.concatenate([b[c] for b in batches]) for c in names})
+
+    # ---------- column access ----------
+    def __len__(self):
+        return self._n or 0
+
+    def __contains__(self, name):
+        return name in self._cols
+
+    def __getitem__(self, name):
+        return self._cols[name]
+
+    def __setitem__(self, name, values):
+        if np.isscalar(values):
+            if self._n is None:
+                raise ValueError("cannot broadcast a scalar into an empty batch")
+            values = np.full(self._n, values)
+        values = np.asarray(values)
+        if self._n is None:
+            self._n = len(values)
+        elif len(values) != self._n:
+            raise ValueError(f"column '{name}' has {len(values)} rows, batch has {self._n}")
+        self._cols[name] = values
+
+    def slice(self, start, stop):
+        """Rows [start, stop) as a new batch of views on the same arrays (no copy)."""
+        return ColumnBatch({n: v[start:stop] for n, v in self._cols.items()})
+
+    def get(self, name, default=0):
+        """Column, or a constant column of `default` when it is missing."""
+        return self._cols[name] if name in self._cols else np.full(len(self), default)
+
+    @property
+    def columns(self):
+        return list(self._cols)
+
+    # ---------- views for consumers ----------
+    def frame(self, names=None, **aliases):
+        """
+        DataFrame over the selected columns without copying them; `aliases` add
+        extra columns as name=array (e.g. a model expecting a different column name).
+        """
+        data = {n: self._cols[n] for n in (self.columns if names is None else names)}
+        data.update(aliases)
+        return pd.DataFrame(data, copy=False)
+
+    def matrix(self, names, dtype=np.float64):
+        """(rows × len(names)) array — one allocation, for models that take plain arrays."""
+        out = np.empty((len(self), len(names)), dtype=dtype)
+        for j, n in enumerate(names):
+            out[:, j] = self._cols[n]
+        return out
+
+    def records(self, names):
+        """List of plain-Python dicts (JSON-ready) for the selected columns."""
+        cols = [self._cols[n].tolist() for n in names]
+        return [dict(zip(names, vals)) for vals in zip(*cols)]
+
+    def to_frame(self):
+        return self.frame()
+
@@ -0,0 +1,195 @@
+"""
+compaction.py
+Retention, downsampling and compaction for the time-series and prediction history:
+ - raw hourly rows are kept for RAW_RETENTION_DAYS
+ - older rows are rolled into daily aggregates (sum / mean / max / count) per
+   hospital / city / department, and weekly aggregates are derived from the daily ones
+ - expired raw rows are only removed after the daily rollup has been written
+`daily_series` stitches rollups and raw rows so lag / rolling queries stay correct across
+the raw/compacted boundary; `daily_with_lags` adds those columns (served by /api/history/daily).
+`rolled_until` is that boundary; raw exports (history_store.py) refuse ranges before it.
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.feature_builder import TS_STORE
+from pipeline.file_lock import file_lock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+ROLLUP_DIR = os.path.join(BASE_DIR, 'rollups')
+
+# retrain.py reads its window from raw rows, so its WINDOW_DAYS follows this value
+RAW_RETENTION_DAYS = int(os.getenv("AADYA_RAW_RETENTION_DAYS", 30))
+MIN_RAW_RETENTION_DAYS = 2   # tp_lag_24 / rolling_7 must always be answerable from raw rows
+CHUNK_ROWS = 100_000
+
+GROUP_KEYS = ['hospital_id', 'city', 'department']
+# source name -> (raw csv, value columns to aggregate)
+SOURCES = {
+    'timeseries': (TS_STORE, ['total_patients', 'patient_forecast', 'pm25', 'pm10', 'no2', 'aqi',
+                              'temperature_c', 'humidity']),
+    'regional_predictions': (os.path.join(OUTPUT_DIR, 'regional_predictions.csv'),
+                             ['patient_forecast', 'conf_low', 'conf_high', 'pm25']),
+    'predictions_log': (os.path.join(OUTPUT_DIR, 'predictions.log'),
+                        ['patient_forecast', 'conf_int_low', 'conf_int_high']),
+}
+
+
+def rollup_path(source, grain):
+    return os.path.join(ROLLUP_DIR, f'{source}_{grain}.csv')
+
+
+def _partial(df, keys, cols):
+    """Per (keys, day) sum / max / count of each value column."""
+    g = df.groupby(keys + ['period_start'], dropna=False)[cols].agg(['sum', 'max', 'count'])
+    g.columns = [f'{c}_{stat}' for c, stat in g.columns]
+    return g.reset_index()
+
+
+def _combine(frames, keys, cols):
+    """Merge partial aggregates of the same periods and (re)derive the means."""
+    df = pd.concat(frames, ignore_index=True)
+    agg = {}
+    for c in cols:
+        agg[f'{c}_sum'] = 'sum'
+        agg[f'{c}_max'] = 'max'
+        agg[f'{c}_count'] = 'sum'
+    out = df.groupby(keys + ['period_start'], dropna=False).agg(agg).reset_index()
+    for c in cols:
+        out[f'{c}_mean'] = out[f'{c}_sum'] / out[f'{c}_count'].where(out[f'{c}_count'] > 0)
+    return out.sort_values(keys + ['period_start']).reset_index(drop=True)
+
+
+def _write_atomic(df, path):
+    tmp = path + '.tmp'
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def rolled_until(source):
+    """Everything before this instant is already in the daily rollup (None if no rollup yet)."""
+    path = rollup_path(source, 'daily')
+    if not os.path.exists(path):
+        return None
+    days = pd.read_csv(path, usecols=['period_start'], parse_dates=['period_start'])['period_start']
+    return days.max() + pd.Timedelta(days=1) if len(days) else None
+
+
+def compact_source(source, retention_days=RAW_RETENTION_DAYS, now=None):
+    """Roll expired raw rows of one source into rollups and drop them from the raw file."""
+    raw_path, value_cols = SOURCES[source]
+    if not os.path.exists(raw_path):
+        return {"source": source, "expired": 0, "kept": 0}
+    retention_days = max(retention_days, MIN_RAW_RETENTION_DAYS)
+    cutoff = pd.Timestamp((now or datetime.utcnow()) - timedelta(days=retention_days)).floor('D')
+
+    with file_lock(raw_path):
+        header = list(pd.read_csv(raw_path, nrows=0).columns)
+        keys = [k for k in GROUP_KEYS if k in header]
+        cols = [c for c in value_cols if c in header]
+        already = rolled_until(source)
+
+        keep_tmp = raw_path + '.compact'
+        partials, expired, kept = [], 0, 0
+        first = True
+        for chunk in pd.read_csv(raw_path, chunksize=CHUNK_ROWS):
+            ts = pd.to_datetime(chunk['timestamp'], errors='coerce', utc=True).dt.tz_localize(None)
+            old = ts < cutoff      # unparseable timestamps compare False and are kept
+            keep = chunk[~old]
+            keep.to_csv(keep_tmp, mode='w' if first else 'a', header=first, index=False)
+            first = False
+            kept += len(keep)
+            # rows before `already` were rolled by an earlier run that stopped before the swap
+            fresh = old & ((ts >= already) if already is not None else True)
+            if fresh.any():
+                part = chunk.loc[fresh, keys + cols].copy()
+                part['period_start'] = ts[fresh].dt.floor('D')
+                partials.append(_partial(part, keys, cols))
+            expired += int(old.sum())
+        if first:
+            pd.DataFrame(columns=header).to_csv(keep_tmp, index=False)
+
+        if partials:
+            daily_path = rollup_path(source, 'daily')
+            os.makedirs(ROLLUP_DIR, exist_ok=True)
+            existing = [pd.read_csv(daily_path, parse_dates=['period_start'])] if os.path.exists(daily_path) else []
+            sum_cols = [f'{c}_{s}' for c in cols for s in ('sum', 'max', 'count')]
+            daily = _combine([e[keys + ['period_start'] + sum_cols] for e in existing] + partials, keys, cols)
+            _write_atomic(daily, daily_path)
+            weekly = daily[keys + ['period_start'] + sum_cols].copy()
+            weekly['period_start'] = weekly['period_start'] - pd.to_timedelta(weekly['period_start'].dt.weekday, unit='D')
+            _write_atomic(_combine([weekly], keys, cols), rollup_path(source, 'weekly'))
+
+        # the rollup is durable; only now drop the expired raw rows
+        os.replace(keep_tmp, raw_path)
+
+    print(f"✅ Compacted {source}: {expired} expired rows rolled up, {kept} raw rows kept")
+    return {"source": source, "expired": expired, "kept": kept, "cutoff": cutoff.isoformat()}
+
+
+def compact_all(retention_days=RAW_RETENTION_DAYS):
+    return [compact_source(s, retention_days) for s in SOURCES]
+
+
+def daily_series(source, value_col, stat='sum', department=None, hospital_id=None, city=None):
+    """
+    Daily `stat` of `value_col` over the full history: compacted days come from the daily
+    rollup, newer days are aggregated from raw rows, so lags / rolling windows over the
+    result are continuous across the boundary. Returns a Series indexed by day.
+    """
+    raw_path, _ = SOURCES[source]
+    filters = {'department': department, 'hospital_id': hospital_id, 'city': city}
+
+    def _filter(df):
+        for k, v in filters.items():
+            if v is not None and k in df:
+                df = df[df[k] == v]
+        return df
+
+    parts = []
+    daily_path = rollup_path(source, 'daily')
+    if os.path.exists(daily_path):
+        d = _filter(pd.read_csv(daily_path, parse_dates=['period_start']))
+        if len(d):
+            by_day = d.groupby('period_start')
+            if stat == 'mean':
+                parts.append(by_day[f'{value_col}_sum'].sum() / by_day[f'{value_col}_count'].sum())
+            else:
+                parts.append(by_day[f'{value_col}_{stat}'].agg('max' if stat == 'max' else 'sum'))
+    if os.path.exists(raw_path):
+        r = _filter(pd.read_csv(raw_path))
+        if len(r):
+            day = pd.to_datetime(r['timestamp'], errors='coerce', utc=True).dt.tz_localize(None).dt.floor('D')
+            parts.append(r.groupby(day)[value_col].agg(stat))
+    if not parts:
+        return pd.Series(dtype=float)
+    # rollup days and raw days never overlap (the cutoff is day-aligned)
+    return pd.concat(parts).sort_index()
+
+
+def daily_with_lags(source, value_col, stat='sum', lags=(1, 7), windows=(7,), **filters):
+    """
+    `daily_series` as a DataFrame (day, value) plus lag_<k> and rolling_<w> columns; days
+    missing from the history count as gaps, so lags are by calendar day.
+    """
+    series = daily_series(source, value_col, stat, **filters)
+    if series.empty:
+        return pd.DataFrame(columns=['day', 'value'])
+    series = series.asfreq('D')
+    df = pd.DataFrame({'value': series})
+    for k in lags:
+        df[f'lag_{k}'] = series.shift(k)
+    for w in windows:
+        df[f'rolling_{w}'] = series.rolling(w, min_periods=1).mean()
+    df.index.name = 'day'
+    return df.reset_index()
+
+
+if __name__ == "__main__":
+    for result in compact_all():
+        print(result)
@@ -0,0 +1,118 @@
+"""
+explain.py
+Batched native feature attributions for the LightGBM forecaster.
+One pred_contrib call over the forecaster's inputs (in its training column order) for every city
+and department, cached by (model, feature-row hash), reduced to top-k drivers per department and per city.
+"""
+import os
+import hashlib
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPLAIN_TXT = os.path.join(BASE_DIR, 'output', 'explain.txt')
+
+TOP_K = 3
+CACHE_SIZE = 10_000
+
+_CACHE = OrderedDict()   # (model digest, feature-row bytes hash) -> contribution vector (features + bias)
+_MODEL_DIGESTS = weakref.WeakKeyDictionary()   # booster -> digest of its dumped trees
+
+
+def _booster(model):
+    """Native LightGBM booster behind a model, or None for non-LightGBM fallbacks."""
+    booster = getattr(model, 'booster_', model)
+    return booster if all(hasattr(booster, a) for a in ('predict', 'feature_name', 'model_to_string')) else None
+
+
+def _model_digest(booster):
+    """Content digest of a booster, computed once per booster object (a retrained or reloaded
+    model gets a new digest, so its rows never hit the old model's cache entries)."""
+    digest = _MODEL_DIGESTS.get(booster)
+    if digest is None:
+        digest = hashlib.sha1(booster.model_to_string().encode('utf-8')).hexdigest()
+        _MODEL_DIGESTS[booster] = digest
+    return digest
+
+
+def contributions(model, X):
+    """
+    Per-row feature contributions for matrix X (n × features), last column = bias.
+    Rows already seen are served from the cache; the rest go through one pred_contrib call.
+    Returns None when the model has no native contribution output.
+    """
+    booster = _booster(model)
+    if booster is None:
+        return None
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    digest = _model_digest(booster)
+    keys = [(digest, hash(row.tobytes())) for row in X]
+    out = np.empty((len(X), X.shape[1] + 1))
+    missing = []
+    for i, k in enumerate(keys):
+        cached = _CACHE.get(k)
+        if cached is None:
+            missing.append(i)
+        else:
+            _CACHE.move_to_end(k)
+            out[i] = cached
+    if missing:
+        contrib = np.asarray(booster.predict(X[missing], pred_contrib=True))
+        out[missing] = contrib
+        for i, row in zip(missing, contrib):
+            _CACHE[keys[i]] = row
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return out
+
+
+def top_drivers(contrib, feature_names, forecast, k=TOP_K):
+    """Top-k |contribution| features as 'name +x%' strings relative to the forecast."""
+    contrib = contrib[:len(feature_names)]
+    order = np.argsort(-np.abs(contrib))[:k]
+    base = abs(forecast) or 1.0
+    return [f"{feature_names[j]} {contrib[j] / base * 100:+.0f}%" for j in order]
+
+
+def explain_cities(model, city_batches, feature_names, k=TOP_K, append=False):
+    """
+    city_batches: {city: ColumnBatch with feature_names + 'department' + 'patient_forecast'}.
+    X is built, and contributions are labelled, in the booster's own feature_name() order;
+    `feature_names` (the artifact's 'features') is used when the booster has no usable names.
+    Returns {city: {"drivers": [...], "departments": {department: [...]}}} and writes
+    (or, with `append`, adds to) explain.txt.
+    """
+    cities = list(city_batches)
+    if not cities:
+        return {}
+    booster = _booster(model)
+    if booster is not None and all(n in city_batches[cities[0]] for n in booster.feature_name()):
+        feature_names = list(booster.feature_name())
+    X = np.vstack([city_batches[c].matrix(feature_names) for c in cities])
+    contrib = contributions(model, X)
+    if contrib is None:
+        return {}
+
+    result, lines, start = {}, [], 0
+    for city in cities:
+        batch = city_batches[city]
+        block = contrib[start:start + len(batch)]
+        start += len(batch)
+        forecasts = batch['patient_forecast']
+        city_total = block.sum(axis=0)
+        result[city] = {
+            "drivers": top_drivers(city_total, feature_names, forecasts.sum(), k),
+            "departments": {
+                dept: top_drivers(block[i], feature_names, forecasts[i], k)
+                for i, dept in enumerate(batch['department'])
+            },
+        }
+        order = np.argsort(-np.abs(city_total[:len(feature_names)]))[:k]
+        lines.append(f"{city} — Top drivers: " + ", ".join(
+            f"{feature_names[j]} ({city_total[j]:.3f})" for j in order))
+
+    with open(EXPLAIN_TXT, 'a' if append else 'w', encoding='utf-8') as f:
+        f.write(("\n" if append else "") + "\n".join(lines))
+    return result
@@ -3,17 +3,43 @@ feature_builder.py
 Flattens context_snapshot.json and builds ML-ready features
 """
 import os
+import sys
 import json
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import joblib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.model_registry import get_artifact
+from pipeline.file_lock import file_lock
+from data_fetchers.epidemic_store import get_store
+from data_fetchers.pollution_latest import CITY_LOCATIONS, LATEST_FILE, location_readings
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONTEXT_FILE = os.path.join(BASE_DIR, 'context_snapshot.json')
 TS_STORE = os.path.join(BASE_DIR, 'timeseries_store.csv')
+MAX_READING_AGE = pd.Timedelta(hours=6)
 MODELS_DIR = os.path.join(BASE_DIR, 'models')
 
+def latest_stored_reading(timestamp, location_id, parameter='pm25', path=LATEST_FILE):
+    """
+    Newest ingested reading of `parameter` from the sensors at OpenAQ `location_id`, if it is at or
+    before `timestamp` and within MAX_READING_AGE; else None. Reads the per-sensor latest values
+    kept at ingest time (data_fetchers/pollution_latest.py), not the full pollution store.
+    A naive `timestamp` is taken as UTC, like the stored datetime_from values.
+    """
+    if location_id is None:
+        return None
+    ts = pd.Timestamp(timestamp)
+    ts = ts.tz_convert('UTC').tz_localize(None) if ts.tzinfo is not None else ts
+    best_t, best_v = None, None
+    for r in location_readings(location_id, parameter, path):
+        t = pd.Timestamp(r['datetime_from'])
+        t = t.tz_convert('UTC').tz_localize(None) if t.tzinfo is not None else t
+        if ts - MAX_READING_AGE <= t <= ts and (best_t is None or t > best_t):
+            best_t, best_v = t, r['value']
+    return best_v
+
 def flatten_context_snapshot(json_path=CONTEXT_FILE):
     """Convert perception JSON to flat features"""
     with open(json_path, 'r') as f:
@@ -27,13 +53,19 @@ def flatten_context_snapshot(json_path=CONTEXT_FILE):
     temperature_c = weather.get('temperature', 25.0)
     humidity = weather.get('humidity', 60.0)
     
-    # Pollution - get latest PM2.5
+    # City/location
+    city = weather.get('city', 'Mumbai')
+    population_density = 20000  # default for Mumbai
+    
+    # Pollution - latest PM2.5 ingested for the city's OpenAQ location, else the snapshot's reading
     pollution = sources.get('pollution', {})
-    pm25 = 0.0
-    if pollution.get('pollution_data'):
-        measurements = pollution['pollution_data'][0].get('measurements', [])
-        if measurements:
-            pm25 = measurements[-1].get('value', 0.0)
+    pm25 = latest_stored_reading(timestamp, pollution.get('location_id') or CITY_LOCATIONS.get(city))
+    if pm25 is None:
+        pm25 = 0.0
+        if pollution.get('pollution_data'):
+            measurements = pollution['pollution_data'][0].get('measurements', [])
+            if measurements:
+                pm25 = measurements[-1].get('value', 0.0)
     
     # Derive pm10, no2 (simple heuristic)
     pm10 = pm25 * 1.2
@@ -53,11 +85,19 @@ def flatten_context_snapshot(json_path=CONTEXT_FILE):
     
     festival_intensity = min(5, len([f for f in festivals if (pd.to_datetime(f['date']) - timestamp).days <= 7]))
     
-    # Epidemics
-    epidemics = sources.get('epidemics', [])
-    epidemic_flag = 1 if epidemics else 0
-    epidemic_types = list(set([e['disease'] for e in epidemics]))
-    epidemic_trend_score = len([e for e in epidemics if e.get('trend') == 'increase'])
+    # Epidemics: precomputed per-area counters from the findings store; scan the snapshot
+    # list only when the store has nothing yet
+    store = get_store()
+    if len(store):
+        epi = store.area_features(city, now=timestamp)  # window ends at the snapshot, not at wall-clock now
+        epidemic_flag = epi['epidemic_flag']
+        epidemic_types = epi['epidemic_types']
+        epidemic_trend_score = epi['epidemic_trend_score']
+    else:
+        epidemics = sources.get('epidemics', [])
+        epidemic_flag = 1 if epidemics else 0
+        epidemic_types = list(set([e['disease'] for e in epidemics]))
+        epidemic_trend_score = len([e for e in epidemics if e.get('trend') == 'increase'])
     
     # Temporal features
     date = timestamp.date()
@@ -69,10 +109,6 @@ def flatten_context_snapshot(json_path=CONTEXT_FILE):
     hour_sin = np.sin(2 * np.pi * hour / 24)
     hour_cos = np.cos(2 * np.pi * hour / 24)
     
-    # City/location
-    city = weather.get('city', 'Mumbai')
-    population_density = 20000  # default for Mumbai
-    
     # Build flat record
     flat = {
         'timestamp': timestamp,
@@ -103,84 +139,96 @@ def flatten_context_snapshot(json_path=CONTEXT_FILE):
     
     return flat
 
-def add_lags_and_rolling(flat_record, departments=['Emergency', 'Pulmonology', 'Cardiology', 'ICU', 'Pediatrics', 'General']):
-    """Add lag and rolling features from historical time series store"""
-    
-    # Load time series store if exists
-    if os.path.exists(TS_STORE):
-        ts_df = pd.read_csv(TS_STORE, parse_dates=['timestamp'])
-    else:
-        ts_df = pd.DataFrame()
-    
-    records = []
-    for dept in departments:
-        rec = flat_record.copy()
-        rec['department'] = dept
-        rec['hospital_id'] = 'HOSP_MUM_001'
-        
-        # Compute lags from historical data
-        if not ts_df.empty:
-            dept_data = ts_df[ts_df['department'] == dept].sort_values('timestamp')
-            if len(dept_data) > 0:
-                # Lag features
-                rec['tp_lag_1'] = dept_data['total_patients'].iloc[-1] if len(dept_data) >= 1 else 0
-                rec['tp_lag_24'] = dept_data['total_patients'].iloc[-24] if len(dept_data) >= 24 else rec['tp_lag_1']
-                rec['pm25_lag1'] = dept_data['pm25'].iloc[-1] if len(dept_data) >= 1 else rec['pm25']
-                rec['pm10_lag1'] = dept_data['pm10'].iloc[-1] if len(dept_data) >= 1 else rec['pm10']
-                rec['no2_lag1'] = dept_data['no2'].iloc[-1] if len(dept_data) >= 1 else rec['no2']
-                
-                # Rolling features
-                rec['rolling_3'] = dept_data['total_patients'].tail(3).mean()
-                rec['rolling_7'] = dept_data['total_patients'].tail(7).mean()
-            else:
-                # Defaults
-                rec['tp_lag_1'] = 0
-                rec['tp_lag_24'] = 0
-                rec['pm25_lag1'] = rec['pm25']
-                rec['pm10_lag1'] = rec['pm10']
-                rec['no2_lag1'] = rec['no2']
-                rec['rolling_3'] = 0
-                rec['rolling_7'] = 0
-        else:
-            # First run - use defaults
-            rec['tp_lag_1'] = 0
-            rec['tp_lag_24'] = 0
-            rec['pm25_lag1'] = rec['pm25']
-            rec['pm10_lag1'] = rec['pm10']
-            rec['no2_lag1'] = rec['no2']
-            rec['rolling_3'] = 0
-            rec['rolling_7'] = 0
-        
-        # Placeholder for actual total_patients (will be filled after prediction)
-        rec['total_patients'] = 0
-        
-        records.append(rec)
-    
-    return pd.DataFrame(records)
+DEPARTMENTS = ['Emergency', 'Pulmonology', 'Cardiology', 'ICU', 'Pediatrics', 'General']
+
+def load_lag_history(path=None):
+    """Time-series store rows per department (oldest first), read once and shared by every city of a run"""
+    path = path or TS_STORE
+    if not os.path.exists(path):
+        return {}
+    ts_df = pd.read_csv(path, parse_dates=['timestamp'])
+    if ts_df.empty:
+        return {}
+    return dict(tuple(ts_df.sort_values('timestamp').groupby('department')))
+
+def lag_columns(flat_record, departments=DEPARTMENTS, history=None):
+    """
+    Feature columns (name -> one value per department) with lag and rolling features, without
+    building a DataFrame. `history` is load_lag_history(); read from the store when None.
+    """
+    if history is None:
+        history = load_lag_history()
+    
+    n = len(departments)
+    cols = {k: [v] * n for k, v in flat_record.items()}
+    cols['department'] = list(departments)
+    cols['hospital_id'] = ['HOSP_MUM_001'] * n
+    
+    # Defaults (first run / department without history)
+    tp_lag_1 = np.zeros(n)
+    tp_lag_24 = np.zeros(n)
+    pm25_lag1 = np.full(n, flat_record['pm25'], dtype=float)
+    pm10_lag1 = np.full(n, flat_record['pm10'], dtype=float)
+    no2_lag1 = np.full(n, flat_record['no2'], dtype=float)
+    rolling_3 = np.zeros(n)
+    rolling_7 = np.zeros(n)
+    
+    # Compute lags from historical data
+    for i, dept in enumerate(departments):
+        dept_data = history.get(dept)
+        if dept_data is None or len(dept_data) == 0:
+            continue
+        patients = dept_data['total_patients'].to_numpy()
+        # Lag features
+        tp_lag_1[i] = patients[-1]
+        tp_lag_24[i] = patients[-24] if len(patients) >= 24 else patients[-1]
+        pm25_lag1[i] = dept_data['pm25'].iloc[-1]
+        pm10_lag1[i] = dept_data['pm10'].iloc[-1]
+        no2_lag1[i] = dept_data['no2'].iloc[-1]
+        # Rolling features
+        rolling_3[i] = patients[-3:].mean()
+        rolling_7[i] = patients[-7:].mean()
+    
+    cols.update({
+        'tp_lag_1': tp_lag_1, 'tp_lag_24': tp_lag_24,
+        'pm25_lag1': pm25_lag1, 'pm10_lag1': pm10_lag1, 'no2_lag1': no2_lag1,
+        'rolling_3': rolling_3, 'rolling_7': rolling_7,
+    })
+    # Placeholder for actual total_patients (will be filled after prediction)
+    cols['total_patients'] = np.zeros(n, dtype=int)
+    
+    return cols
+
+def add_lags_and_rolling(flat_record, departments=DEPARTMENTS):
+    """Add lag and rolling features from historical time series store (one column per feature, not one dict per department)"""
+    return pd.DataFrame(lag_columns(flat_record, departments))
+
+def encode_ids(cols):
+    """Add the label-encoded department / hospital columns (to a DataFrame or a dict of columns)"""
+    le_dep = get_artifact('labelenc_department.pkl')
+    le_h = get_artifact('labelenc_hospital.pkl')
+    cols['department_le'] = le_dep.transform(np.asarray(cols['department'], dtype=str))
+    cols['hospital_le'] = le_h.transform(np.asarray(cols['hospital_id'], dtype=str))
+    return cols
 
 def save_to_timeseries_store(df):
-    """Append to time series store"""
-    if os.path.exists(TS_STORE):
-        existing = pd.read_csv(TS_STORE, parse_dates=['timestamp'])
-        combined = pd.concat([existing, df], ignore_index=True)
-        combined.to_csv(TS_STORE, index=False)
-    else:
-        df.to_csv(TS_STORE, index=False)
+    """Append to time series store (locked against concurrent compaction)"""
+    with file_lock(TS_STORE):
+        if os.path.exists(TS_STORE):
+            existing = pd.read_csv(TS_STORE, parse_dates=['timestamp'])
+            combined = pd.concat([existing, df], ignore_index=True)
+            combined.to_csv(TS_STORE, index=False)
+        else:
+            df.to_csv(TS_STORE, index=False)
     print(f"✅ Saved {len(df)} records to timeseries_store.csv")
 
+def feature_columns(json_path=CONTEXT_FILE, history=None):
+    """flatten → add lags → encode ids, as a dict of columns (see lag_columns)"""
+    return encode_ids(lag_columns(flatten_context_snapshot(json_path), history=history))
+
 def build_features_for_prediction(json_path=CONTEXT_FILE):
     """Main function: flatten → add lags → return prediction-ready DataFrame"""
-    flat = flatten_context_snapshot(json_path)
-    df = add_lags_and_rolling(flat)
-    
-    # Load label encoders
-    le_dep = joblib.load(os.path.join(MODELS_DIR, 'labelenc_department.pkl'))
-    le_h = joblib.load(os.path.join(MODELS_DIR, 'labelenc_hospital.pkl'))
-    
-    df['department_le'] = le_dep.transform(df['department'].astype(str))
-    df['hospital_le'] = le_h.transform(df['hospital_id'].astype(str))
-    
-    return df
+    return pd.DataFrame(feature_columns(json_path))
 
 if __name__ == '__main__':
     # Test
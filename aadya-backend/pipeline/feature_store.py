@@ -0,0 +1,135 @@
+"""
+feature_store.py
+Precomputed feature store written by the prediction pipeline after each run.
+Keyed by (city, hospital_id, department, hour):
+ - hot tier: latest hour per (city, hospital_id, department), kept in memory and mirrored
+   to latest.json so other processes (the API) pick it up without recomputing
+ - disk tier: one CSV partition per day for history
+"""
+import os
+import json
+import threading
+from datetime import datetime
+from functools import lru_cache
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURE_STORE_DIR = os.path.join(BASE_DIR, 'feature_store')
+
+KEY_COLUMNS = ['city', 'hospital_id', 'department', 'hour_ts']
+# read back as text; '' (e.g. no epidemics) must not become NaN, which JSON cannot carry
+TEXT_COLUMNS = KEY_COLUMNS + ['timestamp', 'date', 'epidemic_types']
+# pipeline outputs, not features
+EXCLUDED_COLUMNS = {'patient_forecast', 'conf_low', 'conf_high', 'is_anomaly', 'total_patients'}
+
+
+def _hour(ts):
+    """Hour key as naive-UTC ISO text (how hour_ts is stored); ValueError if unparseable."""
+    t = pd.Timestamp(ts)
+    if pd.isna(t):
+        raise ValueError(f"invalid hour {ts!r}")
+    if t.tzinfo is not None:
+        t = t.tz_convert('UTC').tz_localize(None)
+    return t.floor('h').isoformat()
+
+
+@lru_cache(maxsize=32)
+def _read_partition(path, mtime):
+    df = pd.read_csv(path, dtype={c: str for c in TEXT_COLUMNS})
+    text = [c for c in TEXT_COLUMNS if c in df.columns]
+    df[text] = df[text].fillna('')
+    df = df.astype(object).where(df.notna(), None)  # missing numbers -> null, like the hot tier
+    return {tuple(r[k] for k in KEY_COLUMNS): r for r in df.to_dict('records')}
+
+
+class FeatureStore:
+    def __init__(self, root=FEATURE_STORE_DIR):
+        self.root = root
+        self.latest_path = os.path.join(root, 'latest.json')
+        self._lock = threading.Lock()
+        self._hot = {}          # (city, hospital_id, department) -> row of its latest hour
+        self._updated_at = None
+        self._loaded_mtime = None
+
+    # ---------- write side (pipeline) ----------
+    def write(self, df):
+        """Store one pipeline run's feature rows in both tiers."""
+        cols = [c for c in df.columns if c not in EXCLUDED_COLUMNS]
+        feats = df[cols].copy()
+        feats['hour_ts'] = (pd.to_datetime(feats['timestamp'], utc=True).dt.tz_localize(None)
+                            .dt.floor('h').map(lambda t: t.isoformat()))
+        rows = json.loads(feats.to_json(orient='records', date_format='iso'))
+
+        os.makedirs(self.root, exist_ok=True)
+        for day, part in feats.groupby(feats['hour_ts'].str[:10]):
+            path = os.path.join(self.root, f'{day}.csv')
+            if os.path.exists(path):
+                header = list(pd.read_csv(path, nrows=0).columns)
+                part = part.reindex(columns=header)
+            part.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+        with self._lock:
+            self._refresh()
+            hot = dict(self._hot)  # copy-on-write: readers may still be iterating the old dict
+            for r in rows:
+                key = (r.get('city'), r.get('hospital_id'), r.get('department'))
+                current = hot.get(key)
+                if current is None or current['hour_ts'] <= r['hour_ts']:
+                    hot[key] = r
+            self._hot = hot
+            self._updated_at = datetime.utcnow().isoformat()
+            tmp = self.latest_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'updated_at': self._updated_at, 'rows': list(self._hot.values())}, f)
+            os.replace(tmp, self.latest_path)
+            self._loaded_mtime = os.path.getmtime(self.latest_path)
+        print(f"✅ Stored {len(rows)} feature rows in feature store")
+
+    # ---------- read side (API / consumers) ----------
+    def _refresh(self):
+        """Reload the hot tier if another process published a newer latest.json."""
+        if not os.path.exists(self.latest_path):
+            return
+        mtime = os.path.getmtime(self.latest_path)
+        if mtime == self._loaded_mtime:
+            return
+        with open(self.latest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self._hot = {(r.get('city'), r.get('hospital_id'), r.get('department')): r for r in data['rows']}
+        self._updated_at = data.get('updated_at')
+        self._loaded_mtime = mtime
+
+    def latest(self, city=None, hospital_id=None, department=None):
+        """Latest-hour rows, optionally filtered; returns (updated_at, rows)."""
+        with self._lock:
+            self._refresh()
+            hot, updated_at = self._hot, self._updated_at
+        if city is not None and hospital_id is not None and department is not None:
+            row = hot.get((city, hospital_id, department))
+            return updated_at, [row] if row else []
+        rows = [r for (c, h, d), r in hot.items()
+                if (city is None or c == city) and (hospital_id is None or h == hospital_id)
+                and (department is None or d == department)]
+        return updated_at, rows
+
+    def get(self, city, hospital_id, department, hour):
+        """
+        Feature row for one key and hour (any ISO form; tz-aware hours are converted to UTC):
+        hot tier first, then that day's partition. Raises ValueError for an unparseable hour.
+        """
+        hour_ts = _hour(hour)
+        _, rows = self.latest(city, hospital_id, department)
+        if rows and rows[0]['hour_ts'] == hour_ts:
+            return rows[0]
+        path = os.path.join(self.root, f'{hour_ts[:10]}.csv')
+        if not os.path.exists(path):
+            return None
+        return _read_partition(path, os.path.getmtime(path)).get((city, hospital_id, department, hour_ts))
+
+    def latest_frame(self, city=None, hospital_id=None):
+        """Latest-hour rows as a DataFrame (one row per hospital/department)."""
+        _, rows = self.latest(city=city, hospital_id=hospital_id)
+        return pd.DataFrame(rows)
+
+
+FEATURE_STORE = FeatureStore()
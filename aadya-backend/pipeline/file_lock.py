@@ -0,0 +1,44 @@
+"""
+file_lock.py
+Advisory inter-process lock for the CSV stores that are appended to by the pipeline and
+rewritten by maintenance jobs (compaction). No-op where fcntl is unavailable.
+"""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on `<path>.lock` for the duration of the block."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'a') as fh:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def try_lock(path):
+    """
+    Non-blocking exclusive lock on `<path>.lock`, held until the returned handle is closed
+    (or the process exits). Returns None if another process holds it.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fh = open(path + '.lock', 'a')
+    if fcntl is None:
+        return fh
+    try:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return None
+    return fh
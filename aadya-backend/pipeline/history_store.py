@@ -0,0 +1,267 @@
+"""
+history_store.py
+Append-only insight history + chunked, filterable readers/encoders for streaming exports,
+and the latest insight rows published for the other server workers
+"""
+import os
+import io
+import csv
+import json
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = None
+    pq = None
+
+from pipeline.compaction import rolled_until
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+INSIGHTS_HISTORY = os.path.join(OUTPUT_DIR, 'insights_history.csv')
+PREDICTIONS_LOG = os.path.join(OUTPUT_DIR, 'regional_predictions.csv')
+INSIGHTS_LATEST = os.path.join(OUTPUT_DIR, 'insights_latest.json')
+
+INSIGHT_KEYS = ["timestamp", "area_id", "area_name", "pm25", "surge_risk", "expected_patients_hr", "oxygen_extra"]
+
+# source name -> (csv path, column holding the area / city key)
+HISTORY_SOURCES = {
+    "insights": (INSIGHTS_HISTORY, "area_id"),
+    "predictions": (PREDICTIONS_LOG, "city"),
+}
+
+# export source -> compaction.SOURCES name; rows older than its rollup are no longer raw
+COMPACTED_SOURCES = {
+    "predictions": "regional_predictions",
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+EXPORT_CHUNK_ROWS = 50_000
+
+# always exported as text, even when a chunk holds only empty values (e.g. no epidemics)
+TEXT_COLUMNS = {"timestamp", "date", "area_id", "area_name", "city", "hospital_id", "department",
+                "epidemic_types"}
+
+
+def append_insights(rows, path=INSIGHTS_HISTORY):
+    """Append insight rows to the on-disk history (header written once)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_header = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=INSIGHT_KEYS, extrasaction="ignore")
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def publish_latest(rows, last_update, path=INSIGHTS_LATEST):
+    """Atomically publish the current insight rows for the other server workers."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"last_update": last_update, "insights": rows}, f)
+    os.replace(tmp, path)
+
+
+def read_latest(since_mtime=None, path=INSIGHTS_LATEST):
+    """(mtime, payload) of the published insights; payload is None if unchanged since `since_mtime` or missing."""
+    try:
+        mtime = os.path.getmtime(path)
+        if mtime == since_mtime:
+            return mtime, None
+        with open(path, "r", encoding="utf-8") as f:
+            return mtime, json.load(f)
+    except (OSError, ValueError):
+        return since_mtime, None
+
+
+def _to_utc(value):
+    if value is None:
+        return None
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+def compacted_before(source):
+    """
+    UTC instant before which `source` rows were rolled into daily rollups and dropped from
+    the raw file by compaction.py, or None if none were.
+    """
+    if source not in COMPACTED_SOURCES:
+        return None
+    cutoff = rolled_until(COMPACTED_SOURCES[source])
+    return None if cutoff is None else cutoff.tz_localize("UTC")
+
+
+def iter_history(source="insights", area_id=None, start=None, end=None, columns=None,
+                 chunksize=EXPORT_CHUNK_ROWS):
+    """
+    Return an iterator of filtered DataFrame chunks from a history source.
+    Only one chunk is held in memory at a time, so exports of any size stay flat.
+    Validation runs eagerly: raises ValueError for an unknown source or unknown columns, or a
+    `start` before compacted_before(source) (those rows only exist as daily rollups), and
+    FileNotFoundError when nothing has been recorded for the source yet.
+    If no row matches, a single empty chunk is yielded so encoders can still write a header / schema.
+    """
+    if source not in HISTORY_SOURCES:
+        raise ValueError(f"unknown source '{source}' (expected one of {sorted(HISTORY_SOURCES)})")
+    path, area_col = HISTORY_SOURCES[source]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"no '{source}' history recorded yet")
+
+    header = list(pd.read_csv(path, nrows=0).columns)
+    if columns:
+        unknown = [c for c in columns if c not in header]
+        if unknown:
+            raise ValueError(f"unknown columns for '{source}': {unknown}")
+    else:
+        columns = header
+
+    start, end = _to_utc(start), _to_utc(end)
+    cutoff = compacted_before(source)
+    if start is not None and cutoff is not None and start < cutoff:
+        raise ValueError(f"'{source}' rows before {cutoff.isoformat()} were compacted into daily "
+                         f"rollups; use start >= that or /api/history/daily")
+    needed = set(columns)
+    if area_id is not None:
+        needed.add(area_col)
+    if (start is not None or end is not None) and "timestamp" in header:
+        needed.add("timestamp")
+    usecols = [c for c in header if c in needed]
+    dtypes = _column_dtypes(path, usecols, chunksize)
+    return _iter_chunks(path, usecols, dtypes, columns, area_col, area_id, start, end, chunksize)
+
+
+def _column_dtypes(path, usecols, nrows):
+    """
+    One dtype per column, fixed from the first chunk so every chunk (and every encoder) sees
+    the same types: text stays text, integers use the nullable Int64 (a later gap does not turn
+    1 into 1.0) and a column with no values yet is read as text.
+    """
+    sample = pd.read_csv(path, usecols=usecols, nrows=nrows,
+                         dtype={c: str for c in usecols if c in TEXT_COLUMNS})
+    dtypes = {}
+    for c in usecols:
+        col = sample[c]
+        if c in TEXT_COLUMNS or col.isna().all():
+            dtypes[c] = "string"
+        elif pd.api.types.is_bool_dtype(col):
+            dtypes[c] = "boolean"
+        elif pd.api.types.is_integer_dtype(col):
+            dtypes[c] = "Int64"
+        elif pd.api.types.is_float_dtype(col):
+            dtypes[c] = "float64"
+        else:
+            dtypes[c] = "string"
+    return dtypes
+
+
+def _iter_chunks(path, usecols, dtypes, columns, area_col, area_id, start, end, chunksize):
+    empty = None
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        if area_id is not None:
+            chunk = chunk[chunk[area_col].astype(str) == area_id]
+        if (start is not None or end is not None) and "timestamp" in chunk:
+            ts = pd.to_datetime(chunk["timestamp"], utc=True, errors="coerce")
+            mask = pd.Series(True, index=chunk.index)
+            if start is not None:
+                mask &= ts >= start
+            if end is not None:
+                mask &= ts < end
+            chunk = chunk[mask]
+        if len(chunk):
+            empty = False
+            yield chunk[columns]
+        elif empty is None:
+            empty = chunk[columns]
+    if empty is not False:
+        yield empty if empty is not None else pd.DataFrame(columns=columns).astype(
+            {c: dtypes[c] for c in columns})
+
+
+def encode_csv(chunks):
+    """CSV bytes: header once, then one block per chunk."""
+    first = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=first).encode("utf-8")
+        first = False
+
+
+def encode_ndjson(chunks):
+    """Newline-delimited JSON bytes, one object per row."""
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        body = chunk.to_json(orient="records", lines=True, date_format="iso")
+        if not body.endswith("\n"):
+            body += "\n"
+        yield body.encode("utf-8")
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file that hands buffered bytes back to the caller instead of keeping them."""
+
+    def __init__(self):
+        self._pending = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        self._pending.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b"".join(self._pending)
+        self._pending = []
+        return data
+
+
+def encode_parquet(chunks):
+    """Parquet bytes, one row group per chunk (requires pyarrow)."""
+    if pa is None:
+        raise RuntimeError("parquet export requires pyarrow")
+    sink = _StreamSink()
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(sink, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+    "parquet": encode_parquet,
+}
+
+
+def stream_history(fmt, **filters):
+    """Return a byte generator for `fmt` over the filtered history."""
+    if fmt not in ENCODERS:
+        raise ValueError(f"unknown format '{fmt}' (expected one of {sorted(ENCODERS)})")
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("parquet export requires pyarrow")
+    return ENCODERS[fmt](iter_history(**filters))
@@ -0,0 +1,144 @@
+"""
+horizon_forecast.py
+Vectorized multi-horizon recursive forecasting (next 24–72 hours).
+The recursion starts from the pipeline's one-step forecast for the current hour t0, so
+step h forecasts hour t0 + h (h = 1..hours). Every step rolls tp_lag_1 / tp_lag_24 / rolling_3 / rolling_7
+forward from the previous step's predictions, moves whichever time features the model takes
+(hour, dow sin/cos, days_to_next_festival) to t0 + h and runs ONE batched predict over all
+cities × departments × Monte Carlo paths. Output: per-hour quantiles.
+"""
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.feature_builder import TS_STORE
+
+HORIZON_HOURS = int(os.getenv("AADYA_FORECAST_HORIZON", 72))
+N_PATHS = 200
+NOISE_SIGMA = 0.15      # relative per-step noise, matches the old ±15 % band
+LAGS = 24               # history needed for tp_lag_24
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def history_buffer(df, ts_path=TS_STORE):
+    """
+    Last LAGS observed total_patients per row of `df` (shape rows × LAGS, oldest first),
+    from the time-series store, matched on city / hospital / department (cities share a hospital
+    id, so the city keeps their series apart); rows without enough history are padded from
+    their lag features.
+    """
+    buf = np.repeat(df['tp_lag_1'].to_numpy(dtype=np.float64)[:, None], LAGS, axis=1)
+    buf[:, 0] = df['tp_lag_24'].to_numpy(dtype=np.float64)
+    if not os.path.exists(ts_path):
+        return buf
+    ts = pd.read_csv(ts_path, usecols=lambda c: c in ('timestamp', 'city', 'department', 'hospital_id', 'total_patients'))
+    keys = [k for k in ('city', 'hospital_id', 'department') if k in ts and k in df]
+    if not keys:
+        return buf
+    tails = {(k if isinstance(k, tuple) else (k,)): g['total_patients'].to_numpy(dtype=np.float64)[-LAGS:]
+             for k, g in ts.sort_values('timestamp').groupby(keys)}
+    for i, key in enumerate(df[keys].itertuples(index=False, name=None)):
+        hist = tails.get(key)
+        if hist is not None and len(hist):
+            buf[i, LAGS - len(hist):] = hist
+    return buf
+
+
+def forecast_horizon(model, df, feature_names, hours=HORIZON_HOURS, n_paths=N_PATHS, sigma=NOISE_SIGMA,
+                     history=None, seed=None):
+    """
+    Recursive forecast for every row of `df` (all cities × departments at once).
+    `feature_names` is the model's input column order (the artifact's 'features'); only the
+    time features it contains are stepped.
+    The current hour comes from df['patient_forecast'] (predicted here if missing) and is
+    not part of the output. Returns an array of shape (hours, n_paths, rows) of simulated
+    patient counts for hours t0+1 .. t0+hours.
+    """
+    rng = np.random.default_rng(seed)
+    col = {c: i for i, c in enumerate(feature_names)}
+    R = len(df)
+    buf = np.broadcast_to(history if history is not None else history_buffer(df), (n_paths, R, LAGS)).copy()
+    X = np.tile(df[feature_names].to_numpy(dtype=np.float64), (n_paths, 1))   # (paths*rows, F)
+
+    base_dow = np.tile(df['dow'].to_numpy(dtype=np.float64), n_paths)
+    base_hour = np.tile(pd.to_datetime(df['timestamp']).dt.hour.to_numpy() if 'timestamp' in df
+                        else np.zeros(R, dtype=int), n_paths)
+    days_to_fest = X[:, col['days_to_next_festival']].copy() if 'days_to_next_festival' in col else None
+
+    def push(pred):
+        """Sample one hour around `pred` (paths*rows), store it as the newest lag and return it."""
+        y = np.maximum(0.0, pred * (1 + sigma * rng.standard_normal(pred.shape))).reshape(n_paths, R)
+        buf[:, :, :-1] = buf[:, :, 1:]
+        buf[:, :, -1] = y
+        return y
+
+    current = (df['patient_forecast'].to_numpy(dtype=np.float64) if 'patient_forecast' in df
+               else np.asarray(model.predict(df[feature_names]), dtype=np.float64))
+    push(np.tile(current, n_paths))   # hour t0
+
+    out = np.empty((hours, n_paths, R))
+    for h in range(hours):
+        step = h + 1                  # hours after t0
+        flat = buf.reshape(n_paths * R, LAGS)
+        X[:, col['tp_lag_1']] = flat[:, -1]
+        X[:, col['tp_lag_24']] = flat[:, 0]
+        X[:, col['rolling_3']] = flat[:, -3:].mean(axis=1)
+        X[:, col['rolling_7']] = flat[:, -7:].mean(axis=1)
+        hour = (base_hour + step) % 24
+        day_offset = (base_hour + step) // 24
+        dow = (base_dow + day_offset) % 7
+        stepped = {
+            'hour': hour,
+            'hour_sin': np.sin(2 * np.pi * hour / 24),
+            'hour_cos': np.cos(2 * np.pi * hour / 24),
+            'dow': dow,
+            'dow_sin': np.sin(2 * np.pi * dow / 7),
+            'dow_cos': np.cos(2 * np.pi * dow / 7),
+        }
+        if days_to_fest is not None:
+            stepped['days_to_next_festival'] = np.where(days_to_fest >= 999, days_to_fest,
+                                                        np.maximum(0, days_to_fest - day_offset))
+        for name, values in stepped.items():
+            if name in col:
+                X[:, col[name]] = values
+        pred = np.asarray(model.predict(pd.DataFrame(X, columns=feature_names, copy=False)), dtype=np.float64)
+        out[h] = push(pred)
+    return out
+
+
+def summarize_horizon(paths, df):
+    """
+    Per-hour quantiles for each (city, department) row and for each city total; `hour` h is
+    the forecast for t0 + h. Returns (rows_df, city_totals: {city: [{hour, timestamp, p05..p95, mean}]}).
+    """
+    hours, _, R = paths.shape
+    labels = [f"p{int(round(q * 100)):02d}" for q in QUANTILES]
+    t0 = pd.to_datetime(df['timestamp']).max() if 'timestamp' in df else pd.Timestamp(datetime.utcnow())
+    stamps = [(t0 + pd.Timedelta(hours=h + 1)).isoformat() for h in range(hours)]
+
+    q = np.quantile(paths, QUANTILES, axis=1)              # (Q, hours, rows)
+    mean = paths.mean(axis=1)                              # (hours, rows)
+    rows = pd.DataFrame({
+        'hour': np.repeat(np.arange(1, hours + 1), R),
+        'timestamp': np.repeat(stamps, R),
+        'city': np.tile(df['city'].to_numpy() if 'city' in df else np.full(R, None), hours),
+        'department': np.tile(df['department'].to_numpy(), hours),
+        'mean': mean.ravel(),
+        **{lab: q[i].ravel() for i, lab in enumerate(labels)},
+    })
+
+    city_totals = {}
+    cities = df['city'].to_numpy() if 'city' in df else np.full(R, None)
+    for city in pd.unique(cities):
+        totals = paths[:, :, cities == city].sum(axis=2)      # (hours, paths)
+        cq = np.quantile(totals, QUANTILES, axis=1)
+        city_totals[city] = [
+            {"hour": h + 1, "timestamp": stamps[h], "mean": float(totals[h].mean()),
+             **{lab: float(cq[i, h]) for i, lab in enumerate(labels)}}
+            for h in range(hours)
+        ]
+    return rows, city_totals
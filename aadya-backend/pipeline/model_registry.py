@@ -0,0 +1,122 @@
+"""
+model_registry.py
+Process-wide cache of model artifacts (forecast, supply, anomaly, label encoders).
+Loaded once — in the pre-fork master when serving with gunicorn (see gunicorn_conf.py),
+so every worker shares the same copy-on-write pages instead of unpickling its own copy.
+"""
+import os
+import gc
+import glob
+import threading
+import joblib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+
+SUPPLY_ITEMS = [
+    'oxygen_cylinder', 'paracetamol_tablet', 'iv_fluid_bag', 'nebulizer_kit',
+    'platelet_units', 'bandage_roll', 'syringe', 'antibiotic_injection'
+]
+# iso_anom.pkl was trained on epidemic_news_count; the feature builder's nearest signal
+# is epidemic_trend_score
+ANOMALY_INPUT_ALIASES = {'epidemic_news_count': 'epidemic_trend_score'}
+
+_ARTIFACTS = {}
+_LOCK = threading.Lock()
+
+
+def get_artifact(filename):
+    """Artifact dict / object for `models/<filename>`, or None if the file is missing."""
+    try:
+        return _ARTIFACTS[filename]
+    except KeyError:
+        pass
+    with _LOCK:
+        if filename not in _ARTIFACTS:
+            path = os.path.join(MODELS_DIR, filename)
+            _ARTIFACTS[filename] = joblib.load(path) if os.path.exists(path) else None
+        return _ARTIFACTS[filename]
+
+
+def preload(freeze=True):
+    """
+    Load every models/*.pkl up front. With `freeze`, move everything allocated so far into
+    the GC's permanent generation so collections in forked workers do not touch (and copy)
+    the shared pages.
+    """
+    for path in sorted(glob.glob(os.path.join(MODELS_DIR, '*.pkl'))):
+        get_artifact(os.path.basename(path))
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return sorted(k for k, v in _ARTIFACTS.items() if v is not None)
+
+
+def reload(filename):
+    """Drop a cached artifact so the next lookup reads the file again (after retraining)."""
+    with _LOCK:
+        _ARTIFACTS.pop(filename, None)
+
+
+def anomaly_inputs(features, columns):
+    """
+    Inputs for iso_anom.pkl in its trained `features` order, taken from `columns`
+    (name -> array) directly or via ANOMALY_INPUT_ALIASES. None if one cannot be supplied.
+    """
+    out = {}
+    for f in features:
+        src = f if f in columns else ANOMALY_INPUT_ALIASES.get(f)
+        if src not in columns:
+            return None
+        out[f] = columns[src]
+    return out
+
+
+# ---------- memory reporting (Linux /proc) ----------
+_MEM_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_report(pid='self'):
+    """Resident / proportional / shared / private memory in MB for one process, or None."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    stats = {}
+    for line in lines:
+        parts = line.split()
+        if parts and parts[0].rstrip(':') in _MEM_FIELDS:
+            stats[parts[0].rstrip(':').lower() + '_mb'] = round(int(parts[1]) / 1024, 1)
+    stats['shared_mb'] = round(stats.get('shared_clean_mb', 0) + stats.get('shared_dirty_mb', 0), 1)
+    stats['private_mb'] = round(stats.get('private_clean_mb', 0) + stats.get('private_dirty_mb', 0), 1)
+    return stats
+
+
+def server_master():
+    """PID of the gunicorn master when served via gunicorn_conf.py (our parent), else None."""
+    pid = os.getenv('AADYA_SERVER_MASTER')
+    return int(pid) if pid and pid.isdigit() and int(pid) == os.getppid() else None
+
+
+def sibling_workers():
+    """PIDs forked by the gunicorn master, including this process (just this one otherwise)."""
+    master = server_master()
+    if master is None:
+        return [os.getpid()]
+    try:
+        with open(f'/proc/{master}/task/{master}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return [os.getpid()]
+
+
+def workers_memory_report():
+    """Per-worker memory for every worker of this server, plus the master (None when not pre-forked)."""
+    master = server_master()
+    return {
+        "master": {"pid": master, **(memory_report(master) or {})} if master else None,
+        "workers": [{"pid": pid, "self": pid == os.getpid(), **(memory_report(pid) or {})}
+                    for pid in sibling_workers()],
+        "artifacts": sorted(k for k, v in _ARTIFACTS.items() if v is not None),
+    }
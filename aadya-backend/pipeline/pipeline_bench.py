@@ -0,0 +1,132 @@
+"""
+pipeline_bench.py
+Pipeline benchmark at growing city counts, with the real models/*.pkl:
+ - per-city DataFrames: the previous pipeline (dict-per-department feature rows, a new
+   DataFrame per stage, 6-row model calls for every city)
+ - shared ColumnBatch: lag_columns + run_stages (one batch per STAGE_GROUP_CITIES cities)
+Reports tracemalloc peak memory and wall time for feature build → forecast → supply →
+anomaly → optimizer → advisory. Both keep every city's advisory, as run_pipeline does, so the
+peak is the advisories plus the largest working set. No time-series store is read, so only the
+stages are measured.
+    python pipeline/pipeline_bench.py [n_cities ...]
+"""
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.feature_builder import DEPARTMENTS, lag_columns, encode_ids
+from pipeline.column_batch import ColumnBatch
+from pipeline.model_registry import get_artifact, anomaly_inputs, preload
+from pipeline.prediction_pipeline import (FORECAST_FEATURES, SUPPLY_FORECAST_ITEMS, STAGE_GROUP_CITIES,
+                                          run_stages)
+
+def flat_records(n_cities, seed=0):
+    """One flatten_context_snapshot-shaped record per synthetic city."""
+    rng = np.random.default_rng(seed)
+    ts = pd.Timestamp('2026-10-19 05:00')
+    records = {}
+    for i in range(n_cities):
+        pm25 = float(rng.uniform(30, 300))
+        records[f'CITY_{i}'] = {
+            'timestamp': ts, 'date': ts.date(), 'hour': ts.hour, 'dow': ts.weekday(),
+            'week_of_year': ts.isocalendar()[1], 'dow_sin': 0.0, 'dow_cos': 1.0,
+            'hour_sin': 0.0, 'hour_cos': 1.0, 'temperature_c': float(rng.uniform(20, 38)),
+            'humidity': float(rng.uniform(30, 90)), 'pm25': pm25, 'pm10': pm25 * 1.2,
+            'no2': 30.0, 'aqi': int(min(500, pm25 * 1.5)), 'festival_flag': 0, 'festival_count': 0,
+            'festival_intensity': 0, 'days_to_next_festival': 999, 'epidemic_flag': int(rng.random() < 0.3),
+            'epidemic_types': '', 'epidemic_trend_score': int(rng.integers(0, 3)),
+            'city': f'CITY_{i}', 'population_density': 20000,
+        }
+    return records
+
+
+# ---------- previous pipeline, kept here as the reference ----------
+def _dataframe_city(city, flat):
+    records = []
+    for dept in DEPARTMENTS:
+        rec = flat.copy()
+        rec.update(department=dept, hospital_id='HOSP_MUM_001', tp_lag_1=0, tp_lag_24=0,
+                   pm25_lag1=rec['pm25'], pm10_lag1=rec['pm10'], no2_lag1=rec['no2'],
+                   rolling_3=0, rolling_7=0, total_patients=0)
+        records.append(rec)
+    df = encode_ids(pd.DataFrame(records))
+
+    preds = get_artifact('forecast_model_lgb.pkl')['model'].predict(df[FORECAST_FEATURES])
+    df['patient_forecast'] = preds
+    df['conf_low'] = preds * 0.85
+    df['conf_high'] = preds * 1.15
+
+    supplies = {}
+    for item in SUPPLY_FORECAST_ITEMS:
+        m = get_artifact(f'supply_{item}.pkl')
+        if m is not None:
+            supplies[item] = float(np.sum(m['model'].predict(df[['patient_forecast', 'dow']].copy())))
+
+    iso = get_artifact('iso_anom.pkl')
+    anom = pd.DataFrame(anomaly_inputs(iso['features'], {
+        'total_patients': df['patient_forecast'], 'pm25': df['pm25'],
+        'pm25_delta': df['pm25'] - df['pm25_lag1'],
+        'ambulance_arrivals': (df['patient_forecast'] * 0.1).astype(int),
+        'epidemic_trend_score': df.get('epidemic_trend_score', 0)}))
+    df['is_anomaly'] = (iso['model'].predict(anom) == -1).astype(int)
+
+    plan = []
+    for _, row in df.iterrows():
+        forecast = row['patient_forecast']
+        nurses = int(np.ceil(forecast / 8))
+        if nurses > 5:
+            plan.append({"city": row.get('city', 'Unknown'), "extra_nurses": nurses - 5,
+                         "reason": f"Forecast {forecast:.0f} patients, need {nurses} nurses"})
+    return {"city": city, "timestamp": datetime.utcnow().isoformat(),
+            "forecast": float(df['patient_forecast'].sum()),
+            "conf_interval": [float(df['conf_low'].sum()), float(df['conf_high'].sum())],
+            "supplies": supplies, "staff_actions": plan, "anomalies_detected": bool(df['is_anomaly'].sum() > 0),
+            "departments": df[['department', 'patient_forecast', 'is_anomaly']].to_dict('records')}
+
+
+def dataframe_pipeline(records):
+    return [_dataframe_city(city, flat) for city, flat in records.items()]
+
+
+# ---------- current pipeline ----------
+def batch_pipeline(records, group_cities=STAGE_GROUP_CITIES):
+    batches = ((city, ColumnBatch(encode_ids(lag_columns(flat, history={})))) for city, flat in records.items())
+    return [a for advisories, _, _ in run_stages(batches, group_cities) for a in advisories]
+
+
+def measure(fn, records):
+    gc.collect()   # garbage left by an earlier run must not count towards this one
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = fn(records)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 1e6, elapsed
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    preload(freeze=False)
+    for fn in (dataframe_pipeline, batch_pipeline):   # warm up lazy imports / caches
+        measure(fn, flat_records(2))
+    city_counts = [int(a) for a in sys.argv[1:]] or [10, 100, 500]
+    print(f"{'cities':>7} | {'per-city DataFrames':>24} | {'shared ColumnBatch':>24}")
+    for n in city_counts:
+        records = flat_records(n)
+        old, old_peak, old_t = measure(dataframe_pipeline, records)
+        new, new_peak, new_t = measure(batch_pipeline, records)
+        same = np.allclose([a["forecast"] for a in old], [a["forecast"] for a in new])
+        print(f"{n:>7} | {old_peak:8.2f} MB {old_t * 1000:9.0f} ms | {new_peak:8.2f} MB {new_t * 1000:9.0f} ms"
+              f"{'' if same else '  (forecasts differ!)'}")
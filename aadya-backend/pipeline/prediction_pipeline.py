@@ -5,14 +5,18 @@ Regional ML pipeline: Multi-City Context → Forecast → Supply → Anomaly →
 import os
 import sys
 import json
-import pandas as pd
 import numpy as np
-import joblib
 from datetime import datetime
 
 # Add parent directory for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pipeline.feature_builder import build_features_for_prediction, save_to_timeseries_store
+from pipeline.feature_builder import feature_columns, load_lag_history, save_to_timeseries_store
+from pipeline.feature_store import FEATURE_STORE
+from pipeline.model_registry import get_artifact, anomaly_inputs
+from pipeline.file_lock import file_lock
+from pipeline.explain import explain_cities
+from pipeline.horizon_forecast import forecast_horizon, summarize_horizon, HORIZON_HOURS
+from pipeline.column_batch import ColumnBatch
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 MODELS_DIR = os.path.join(BASE_DIR, 'models')
@@ -21,8 +25,9 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 REGIONAL_ADVISORY_JSON = os.path.join(OUTPUT_DIR, 'regional_advisory.json')
 PREDICTIONS_LOG = os.path.join(OUTPUT_DIR, 'regional_predictions.csv')
+HORIZON_CSV = os.path.join(OUTPUT_DIR, 'regional_horizon_forecast.csv')
 
-# Forecast features
+# Forecast features (fallback when a forecaster artifact does not record its own 'features')
 FORECAST_FEATURES = [
     'tp_lag_1', 'tp_lag_24', 'rolling_3', 'rolling_7',
     'pm25', 'pm25_lag1', 'pm10', 'pm10_lag1', 'no2', 'no2_lag1',
@@ -32,6 +37,12 @@ FORECAST_FEATURES = [
 ]
 
 
+def forecast_artifact():
+    """(model, input columns in training order) of the forecaster: LightGBM, else random forest."""
+    m = get_artifact('forecast_model_lgb.pkl') or get_artifact('forecast_model_rf.pkl')
+    return m['model'], list(m.get('features') or FORECAST_FEATURES)
+
+
 def load_context_snapshot():
     """Load perception context JSON file (multi-city)."""
     path = os.path.join(BASE_DIR, 'context_snapshot.json')
@@ -39,87 +50,91 @@ def load_context_snapshot():
         return json.load(f)
 
 
-def run_forecast(df):
-    """Forecast patient inflow with confidence intervals."""
+def run_forecast(batch):
+    """Forecast patient inflow with confidence intervals (adds columns to the batch in place)."""
     print("\n🔮 Running Forecast Model...")
-    model_path = os.path.join(MODELS_DIR, 'forecast_model_lgb.pkl')
-    if not os.path.exists(model_path):
-        model_path = os.path.join(MODELS_DIR, 'forecast_model_rf.pkl')
-    m = joblib.load(model_path)
-    model = m['model']
+    model, features = forecast_artifact()
 
-    X = df[FORECAST_FEATURES]
+    X = batch.frame(features)
     preds = model.predict(X)
-    df['patient_forecast'] = preds
-    df['conf_low'] = preds * 0.85
-    df['conf_high'] = preds * 1.15
-    print(f"✅ Forecast complete for {len(df)} samples.")
-    return df
+    batch['patient_forecast'] = preds
+    batch['conf_low'] = preds * 0.85
+    batch['conf_high'] = preds * 1.15
+    print(f"✅ Forecast complete for {len(batch)} samples.")
+    return batch
+
+
+SUPPLY_FORECAST_ITEMS = [
+    'oxygen_cylinder', 'paracetamol_tablet', 'iv_fluid_bag',
+    'platelet_units', 'antibiotic_injection'
+]
 
 
-def run_supply_forecast(df):
-    """Predict supply usage per city and generate purchase suggestions."""
+def run_supply_forecast(batch):
+    """Predict supply usage per row (adds supply_<item> columns) and return the batch totals."""
     print("\n📦 Running Supply Forecasts...")
-    supply_items = [
-        'oxygen_cylinder', 'paracetamol_tablet', 'iv_fluid_bag',
-        'platelet_units', 'antibiotic_injection'
-    ]
     results = {}
-    for item in supply_items:
-        model_path = os.path.join(MODELS_DIR, f'supply_{item}.pkl')
-        if not os.path.exists(model_path):
+    X = batch.frame(['patient_forecast', 'dow'])  # shared by every item model
+    for item in SUPPLY_FORECAST_ITEMS:
+        m = get_artifact(f'supply_{item}.pkl')
+        if m is None:
             continue
-        model = joblib.load(model_path)['model']
-        X = df[['patient_forecast', 'dow']].copy()
-        preds = model.predict(X)
-        results[item] = float(np.sum(preds))
+        model = m['model']
+        batch[f'supply_{item}'] = model.predict(X)
+        results[item] = float(np.sum(batch[f'supply_{item}']))
     print(f"✅ Supply predictions: {results}")
     return results
 
 
-def run_anomaly_detector(df):
+def city_supplies(batch):
+    """Supply totals of one city's rows (from the supply_<item> columns)."""
+    return {item: float(batch[f'supply_{item}'].sum())
+            for item in SUPPLY_FORECAST_ITEMS if f'supply_{item}' in batch}
+
+
+def run_anomaly_detector(batch):
     """Detect anomalies based on forecast + environmental features."""
     print("\n🚨 Detecting Anomalies...")
-    model_path = os.path.join(MODELS_DIR, 'iso_anom.pkl')
-    m = joblib.load(model_path)
+    m = get_artifact('iso_anom.pkl')
     model = m['model']
     features = m['features']
 
-    anom_features = pd.DataFrame({
-        'total_patients': df['patient_forecast'],
-        'pm25': df['pm25'],
-        'pm25_delta': df['pm25'] - df['pm25_lag1'],
-        'ambulance_arrivals': (df['patient_forecast'] * 0.1).astype(int),
-        'epidemic_trend_score': df.get('epidemic_trend_score', 0)
-    })
+    forecast = batch['patient_forecast']
+    anom_inputs = {
+        'total_patients': forecast,
+        'pm25': batch['pm25'],
+        'pm25_delta': batch['pm25'] - batch['pm25_lag1'],
+        'ambulance_arrivals': (forecast * 0.1).astype(int),
+        'epidemic_trend_score': batch.get('epidemic_trend_score', 0)
+    }
 
-    X = anom_features[features]
+    X = batch.frame([], **anomaly_inputs(features, anom_inputs))
     is_anomaly = model.predict(X)
-    df['is_anomaly'] = (is_anomaly == -1).astype(int)
-    total = df['is_anomaly'].sum()
+    batch['is_anomaly'] = (is_anomaly == -1).astype(int)
+    total = int(batch['is_anomaly'].sum())
 
     if total > 0:
         print(f"⚠️  {total} anomalies detected.")
     else:
         print("✅ No anomalies detected.")
-    return df, total > 0
+    return batch, total > 0
 
 
-def run_staff_optimizer(df):
+def run_staff_optimizer(batch):
     """Basic staff optimization."""
     print("\n👥 Running Staff Optimizer...")
-    plan = []
-    for _, row in df.iterrows():
-        forecast = row['patient_forecast']
-        city = row.get('city', 'Unknown')
-        nurses_needed = int(np.ceil(forecast / 8))
-        baseline = 5
-        if nurses_needed > baseline:
-            plan.append({
-                "city": city,
-                "extra_nurses": nurses_needed - baseline,
-                "reason": f"Forecast {forecast:.0f} patients, need {nurses_needed} nurses"
-            })
+    baseline = 5
+    forecast = batch['patient_forecast']
+    nurses_needed = np.ceil(forecast / 8).astype(int)
+    cities = batch.get('city', 'Unknown')
+    plan = [
+        {
+            "city": cities[i],
+            "extra_nurses": int(nurses_needed[i] - baseline),
+            "reason": f"Forecast {forecast[i]:.0f} patients, need {nurses_needed[i]} nurses"
+        }
+        for i in np.flatnonzero(nurses_needed > baseline)
+    ]
     if plan:
         print(f"✅ Generated {len(plan)} staffing actions.")
     else:
@@ -127,25 +142,95 @@ def run_staff_optimizer(df):
     return plan
 
 
-def generate_city_advisory(city, df, supplies, anomalies, staff):
+def run_horizon_forecast(batch, hours=HORIZON_HOURS, append=False):
+    """
+    Recursive 1..hours-ahead forecast for every row of `batch` (all its cities at once);
+    returns per-city hourly quantiles. With `append`, rows are added to HORIZON_CSV.
+    """
+    if hours <= 0 or not len(batch):
+        return {}
+    print(f"\n⏩ Running {hours}h Horizon Forecast...")
+    model, features = forecast_artifact()
+    df = batch.to_frame()
+    paths = forecast_horizon(model, df, features, hours=hours)
+    rows, city_totals = summarize_horizon(paths, df)
+    rows.to_csv(HORIZON_CSV, mode='a' if append else 'w', header=not append, index=False)
+    print(f"✅ Horizon forecast complete: {hours}h × {len(df)} series × {paths.shape[1]} paths.")
+    return city_totals
+
+
+def generate_city_advisory(city, batch, supplies, anomalies, staff):
     """Generate structured JSON advisory for a city."""
-    total_forecast = float(df['patient_forecast'].sum())
+    total_forecast = float(batch['patient_forecast'].sum())
     advisory = {
         "city": city,
         "timestamp": datetime.utcnow().isoformat(),
         "forecast": total_forecast,
         "conf_interval": [
-            float(df['conf_low'].sum()),
-            float(df['conf_high'].sum())
+            float(batch['conf_low'].sum()),
+            float(batch['conf_high'].sum())
         ],
         "supplies": supplies,
         "staff_actions": staff,
         "anomalies_detected": anomalies > 0,
-        "departments": df[['department', 'patient_forecast', 'is_anomaly']].to_dict('records')
+        "departments": batch.records(['department', 'patient_forecast', 'is_anomaly'])
     }
     return advisory
 
 
+# cities per shared batch: bounds peak memory however many cities there are
+STAGE_GROUP_CITIES = 8
+
+
+def run_stages(city_batches, group_cities=STAGE_GROUP_CITIES):
+    """
+    Forecast → Supply → Anomaly for a group of cities in ONE shared batch (one predict per model
+    per group), then Optimizer → Advisory on zero-copy per-city slices of it.
+    city_batches: iterable of (city, ColumnBatch of its feature rows), consumed lazily so at most
+    one group is held at a time (wrap DataFrames with ColumnBatch.from_frame).
+    Yields (advisories, batch, {city: slice}) per group of up to `group_cities` cities.
+    """
+    group = []
+    for city, city_batch in city_batches:
+        group.append((city, city_batch))
+        if len(group) >= group_cities:
+            yield _run_group(group)
+            group = []
+    if group:
+        yield _run_group(group)
+
+
+def _run_group(group):
+    cities = [city for city, _ in group]
+    sizes = [len(b) for _, b in group]
+    batch = ColumnBatch.concat(b for _, b in group)
+    group.clear()   # the concatenated batch now holds the only copy
+    batch['city'] = np.repeat(np.array(cities, dtype=object), sizes)
+
+    batch = run_forecast(batch)
+    run_supply_forecast(batch)
+    batch, _ = run_anomaly_detector(batch)
+
+    advisories, city_batches = [], {}
+    bounds = np.cumsum([0] + sizes)
+    for city, start, stop in zip(cities, bounds[:-1], bounds[1:]):
+        city_batch = batch.slice(start, stop)
+        staff_plan = run_staff_optimizer(city_batch)
+        anomalies = int(city_batch['is_anomaly'].sum())
+        advisories.append(generate_city_advisory(city, city_batch, city_supplies(city_batch), anomalies, staff_plan))
+        city_batches[city] = city_batch
+    return advisories, batch, city_batches
+
+
+def iter_city_batches(cities):
+    """(city, ColumnBatch of features) pairs, built one city at a time as they are consumed."""
+    history = load_lag_history()   # one read of the time-series store for the whole run
+    for city in cities:
+        print(f"\n🏙️ Building features for {city}...")
+        # Build features per city (your builder must read weather + pollution for that city)
+        yield city, ColumnBatch(feature_columns(city, history))
+
+
 def run_pipeline():
     """Main Regional Prediction Orchestrator."""
     print("\n============================================")
@@ -156,24 +241,40 @@ def run_pipeline():
     cities = context.get("city_data", {}).keys()
 
     regional_advisory = {"timestamp": datetime.utcnow().isoformat(), "cities": []}
+    forecaster, forecast_features = forecast_artifact()
 
-    for city in cities:
-        print(f"\n🏙️ Processing {city}...")
-        # Build features per city (your builder must read weather + pollution for that city)
-        df = build_features_for_prediction(city)
-        df = run_forecast(df)
-        supplies = run_supply_forecast(df)
-        df, anomaly_detected = run_anomaly_detector(df)
-        staff_plan = run_staff_optimizer(df)
-
-        advisory = generate_city_advisory(city, df, supplies, anomaly_detected, staff_plan)
-        regional_advisory["cities"].append(advisory)
+    # every stage reads / adds columns on one batch per group of cities
+    written = False   # explain.txt / horizon CSV are rewritten by the first group, appended to after
+    for advisories, batch, city_batches in run_stages(iter_city_batches(cities)):
+        regional_advisory["cities"].extend(advisories)
+        if not len(batch):
+            continue
+        out = batch.frame([c for c in batch.columns if not c.startswith('supply_')])
+        FEATURE_STORE.write(out)
 
         # Log city-level predictions
-        df.to_csv(PREDICTIONS_LOG, mode='a', header=not os.path.exists(PREDICTIONS_LOG), index=False)
-
-        # Save city data to time-series store
-        save_to_timeseries_store(df)
+        with file_lock(PREDICTIONS_LOG):
+            out.to_csv(PREDICTIONS_LOG, mode='a', header=not os.path.exists(PREDICTIONS_LOG), index=False)
+
+        # Save the group's rows to the time-series store in one append
+        save_to_timeseries_store(out)
+
+        # === Explain: one native contribution call for the group's cities and departments ===
+        explanations = explain_cities(forecaster, city_batches, forecast_features, append=written)
+        for advisory in advisories:
+            expl = explanations.get(advisory["city"])
+            if not expl:
+                continue
+            advisory["explain"] = expl["drivers"]
+            for dept in advisory["departments"]:
+                dept["drivers"] = expl["departments"].get(dept["department"], [])
+
+        # === Multi-horizon forecast: one batched predict per hour for the group ===
+        horizons = run_horizon_forecast(batch, append=written)
+        for advisory in advisories:
+            if advisory["city"] in horizons:
+                advisory["horizon"] = horizons[advisory["city"]]
+        written = True
 
     # === Aggregate regional summary ===
     regional_advisory["summary"] = {
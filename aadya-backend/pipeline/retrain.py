@@ -0,0 +1,261 @@
+"""
+retrain.py
+Nightly retraining from the time-series store:
+ - reads only the recent window of timeseries_store.csv, and trains only on rows with a real
+   total_patients label (the pipeline appends 0 placeholders for hours not yet observed)
+ - refits the IsolationForest, and every supply model that has usage labels, in parallel
+   across a process pool
+ - NOT DELIVERED YET: supply retraining. A supply model needs `<item>_used` usage labels and
+   nothing in this repo records them (there is no usage feed), so all 8 supply models are
+   reported as skipped and keep their shipped artifacts until such a feed writes those columns
+ - continues boosting the LightGBM forecaster from its previous booster, on the artifact's own
+   'features' (its training column order), instead of starting over
+ - writes versioned artifacts + evaluation metrics to models/versions/<version>/ and
+   promotes to models/ atomically only the artifacts whose holdout MAE did not get worse
+"""
+import os
+import sys
+import json
+import shutil
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.base import clone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.feature_builder import TS_STORE
+from pipeline.prediction_pipeline import FORECAST_FEATURES, MODELS_DIR
+from pipeline.model_registry import get_artifact, reload, anomaly_inputs, SUPPLY_ITEMS
+from pipeline.compaction import RAW_RETENTION_DAYS
+
+VERSIONS_DIR = os.path.join(MODELS_DIR, 'versions')
+SUPPLY_EVAL = os.path.join(MODELS_DIR, 'supply_eval.csv')
+
+WINDOW_DAYS = RAW_RETENTION_DAYS   # older raw rows have been compacted into feature-less rollups
+HOLDOUT_FRACTION = 0.2
+FORECAST_EXTRA_ROUNDS = 50
+TARGET = 'total_patients'
+SUPPLY_LABEL = '{}_used'   # per-item usage label a supply feed would have to record
+# LightGBM aliases of num_iterations; a stored value would override num_boost_round
+ROUND_PARAMS = {'num_iterations', 'num_iteration', 'n_iter', 'num_tree', 'num_trees', 'num_round',
+                'num_rounds', 'nrounds', 'num_boost_round', 'n_estimators', 'max_iter'}
+
+
+def load_recent_window(days=WINDOW_DAYS, path=TS_STORE, chunksize=100_000):
+    """Rows of the time-series store from the last `days` days, read chunk by chunk."""
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    if days > RAW_RETENTION_DAYS:
+        print(f"⚠️  Only the last {RAW_RETENTION_DAYS} days are kept as raw rows "
+              f"(AADYA_RAW_RETENTION_DAYS); a {days}-day window will see no more than that.")
+    cutoff = pd.Timestamp(datetime.utcnow() - timedelta(days=days))
+    parts = []
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        ts = pd.to_datetime(chunk['timestamp'], errors='coerce', utc=True).dt.tz_localize(None)
+        chunk = chunk[ts >= cutoff]
+        if len(chunk):
+            parts.append(chunk)
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    if not df.empty:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce', utc=True).dt.tz_localize(None)
+        df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    return df
+
+
+def labelled(frame):
+    """Rows with an observed TARGET (drops the pipeline's 0 placeholders)."""
+    if frame.empty or TARGET not in frame:
+        return frame.iloc[:0]
+    return frame[frame[TARGET].fillna(0).ne(0)].reset_index(drop=True)
+
+
+def _mae(model, X, y):
+    return float(np.mean(np.abs(np.asarray(model.predict(X)) - y)))
+
+
+def _split(df):
+    """Time-ordered train / holdout split."""
+    cut = int(len(df) * (1 - HOLDOUT_FRACTION))
+    return df.iloc[:cut], df.iloc[cut:]
+
+
+def _single_thread(model):
+    """Keep each pool worker on one core so parallel fits don't oversubscribe the CPU."""
+    params = model.get_params()
+    for key in ('n_jobs', 'num_threads'):
+        if key in params:
+            model.set_params(**{key: 1})
+    return model
+
+
+def _has_usage_labels(item, frame):
+    label = SUPPLY_LABEL.format(item)
+    return label in frame and frame[label].notna().any()
+
+
+# ---------- pool tasks (module-level so they pickle) ----------
+def _train_supply(item, artifact, frame):
+    label = SUPPLY_LABEL.format(item)
+    data = frame[['patient_forecast', 'dow', label]].dropna()
+    train, test = _split(data)
+    model = _single_thread(clone(artifact['model']))
+    model.fit(train[['patient_forecast', 'dow']], train[label])
+    metrics = {"rows": len(data), "mae": None}
+    if len(test):
+        X, y = test[['patient_forecast', 'dow']], test[label].to_numpy()
+        metrics.update(mae_before=_mae(artifact['model'], X, y), mae=_mae(model, X, y))
+    return item, {**artifact, 'model': model}, metrics
+
+
+def _train_anomaly(artifact, frame):
+    inputs = anomaly_inputs(artifact['features'], {
+        'total_patients': frame[TARGET],
+        'pm25': frame['pm25'],
+        'pm25_delta': frame['pm25'] - frame['pm25_lag1'],
+        'ambulance_arrivals': (frame[TARGET] * 0.1).astype(int),
+        'epidemic_trend_score': frame.get('epidemic_trend_score', pd.Series(0, index=frame.index)),
+    })
+    if inputs is None:
+        return 'iso_anom', None, {"skipped": f"cannot build inputs {artifact['features']}"}
+    data = pd.DataFrame(inputs).dropna()
+    train, test = _split(data)
+    model = _single_thread(clone(artifact['model']))
+    model.fit(train)
+    flagged = float(np.mean(model.predict(test) == -1)) if len(test) else None
+    return 'iso_anom', {**artifact, 'model': model}, {"holdout_flag_rate": flagged, "rows": len(data)}
+
+
+def _train_forecast(artifact, frame, extra_rounds=FORECAST_EXTRA_ROUNDS):
+    """
+    Continue boosting from the previous booster on the new window, with the inputs the
+    booster was trained on (artifact['features']), so the new trees split the same columns.
+    """
+    features = list(artifact.get('features') or FORECAST_FEATURES)
+    missing = [c for c in features if c not in frame]
+    if missing:
+        return 'forecast_model_lgb', None, {"skipped": f"window lacks model inputs {missing}"}
+    data = frame[features + [TARGET]].dropna()
+    train, test = _split(data)
+    old = artifact['model']
+    if hasattr(old, 'booster_'):  # LGBMRegressor
+        model = clone(old).set_params(n_estimators=extra_rounds)
+        model.fit(train[features], train[TARGET], init_model=old.booster_)
+    else:  # raw lightgbm.Booster
+        import lightgbm as lgb
+        params = {k: v for k, v in old.params.items() if k not in ROUND_PARAMS}
+        model = lgb.train(params, lgb.Dataset(train[features], train[TARGET]),
+                          num_boost_round=extra_rounds, init_model=old, keep_training_booster=True)
+    metrics = {"rows": len(data), "extra_rounds": extra_rounds,
+               "trees_before": _num_trees(old), "trees": _num_trees(model), "mae": None}
+    if len(test):
+        X, y = test[features], test[TARGET].to_numpy()
+        metrics.update(mae_before=_mae(old, X, y), mae=_mae(model, X, y))
+    return 'forecast_model_lgb', {**artifact, 'model': model}, metrics
+
+
+def _num_trees(model):
+    return getattr(model, 'booster_', model).num_trees()
+
+
+# ---------- orchestration ----------
+def _accepted(m):
+    """
+    Promotion gate: supervised models need a holdout MAE no worse than the current model's
+    (no holdout means no promotion); the unsupervised IsolationForest has no MAE and passes.
+    """
+    if "mae" not in m:
+        return True
+    return m["mae"] is not None and m["mae"] <= m["mae_before"]
+
+
+def _write_version(version, results):
+    """Dump every retrained artifact + metrics.json into models/versions/<version>/."""
+    vdir = os.path.join(VERSIONS_DIR, version)
+    os.makedirs(vdir, exist_ok=True)
+    metrics = {}
+    for name, artifact, m in results:
+        metrics[name] = {**m, "accepted": artifact is not None and _accepted(m)}
+        if artifact is not None:
+            artifact = {**artifact, 'version': version}
+            joblib.dump(artifact, os.path.join(vdir, f'{name}.pkl'))
+    with open(os.path.join(vdir, 'metrics.json'), 'w', encoding='utf-8') as f:
+        json.dump({"version": version, "trained_at": datetime.utcnow().isoformat(), "models": metrics}, f, indent=2)
+    return vdir, metrics
+
+
+def promote(version, force=False):
+    """
+    Copy a version's accepted artifacts over models/*.pkl (atomic per file) and refresh caches.
+    `force` also promotes artifacts that failed the holdout gate. Returns the promoted names.
+    """
+    vdir = os.path.join(VERSIONS_DIR, version)
+    with open(os.path.join(vdir, 'metrics.json'), 'r', encoding='utf-8') as f:
+        metrics = json.load(f)["models"]
+    promoted = []
+    for fname in sorted(os.listdir(vdir)):
+        if not fname.endswith('.pkl'):
+            continue
+        if not force and not metrics.get(fname[:-len('.pkl')], {}).get("accepted"):
+            continue
+        tmp = os.path.join(MODELS_DIR, fname + '.tmp')
+        shutil.copyfile(os.path.join(vdir, fname), tmp)
+        os.replace(tmp, os.path.join(MODELS_DIR, fname))
+        reload(fname)
+        promoted.append(fname)
+    return promoted
+
+
+def retrain_all(days=WINDOW_DAYS, max_workers=None, promote_version=True):
+    """Retrain every model from the recent window; returns (version, metrics)."""
+    print("\n🛠️  Retraining models from time-series store...")
+    window = load_recent_window(days)
+    frame = labelled(window)
+    if frame.empty:
+        print(f"⚠️  No labelled '{TARGET}' rows in the last {days} days; nothing to retrain.")
+        return None, {}
+
+    version = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    # usage labels are independent of the patient label, so supply models see the whole window
+    supply_items = [i for i in SUPPLY_ITEMS if get_artifact(f'supply_{i}.pkl') is not None]
+    trainable = [i for i in supply_items if _has_usage_labels(i, window)]
+    supply_frame = window[['patient_forecast', 'dow'] + [SUPPLY_LABEL.format(i) for i in trainable]]
+    results = [(f'supply_{i}', None, {"skipped": f"no '{SUPPLY_LABEL.format(i)}' usage labels recorded"})
+               for i in supply_items if i not in trainable]
+    if not trainable:
+        print(f"⚠️  Supply models NOT retrained: no '<item>_used' usage labels are recorded "
+              f"(no usage feed yet); keeping the {len(supply_items)} shipped supply models.")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_train_supply, item, get_artifact(f'supply_{item}.pkl'), supply_frame)
+            for item in trainable
+        ]
+        futures.append(pool.submit(_train_anomaly, get_artifact('iso_anom.pkl'), frame))
+        # the forecaster is the longest job: boost it here while the pool handles the rest
+        results.append(_train_forecast(get_artifact('forecast_model_lgb.pkl'), frame))
+        for fut in futures:
+            name, artifact, m = fut.result()
+            results.append((name if name == 'iso_anom' else f'supply_{name}', artifact, m))
+
+    vdir, metrics = _write_version(version, results)
+    promoted = promote(version) if promote_version else []
+    # supply_eval.csv describes the models in models/, so only promoted items are updated
+    supply_mae = {n[len('supply_'):]: metrics[n]["mae"] for n in (f[:-len('.pkl')] for f in promoted)
+                  if n.startswith('supply_')}
+    if supply_mae:
+        evals = pd.read_csv(SUPPLY_EVAL) if os.path.exists(SUPPLY_EVAL) else pd.DataFrame(columns=['item', 'mae'])
+        evals = evals[~evals['item'].isin(supply_mae.keys())]
+        evals = pd.concat([evals, pd.DataFrame({'item': list(supply_mae), 'mae': list(supply_mae.values())})])
+        evals.to_csv(SUPPLY_EVAL, index=False)
+
+    print(f"✅ Retrained version {version} → {vdir} (promoted: {', '.join(promoted) or 'none'})")
+    for name, m in metrics.items():
+        print(f"   {name}: {m}")
+    return version, metrics
+
+
+if __name__ == "__main__":
+    retrain_all()
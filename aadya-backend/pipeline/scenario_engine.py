@@ -0,0 +1,228 @@
+"""
+scenario_engine.py
+Vectorized Monte Carlo what-if engine: perturb PM2.5 / temperature / festival / epidemic
+inputs for thousands of samples at once and push them through the trained forecast,
+supply and anomaly models in batched calls.
+"""
+import os
+import sys
+import time
+import weakref
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.feature_builder import build_features_for_prediction, CONTEXT_FILE
+from pipeline.prediction_pipeline import forecast_artifact
+from pipeline.feature_store import FEATURE_STORE
+from pipeline.model_registry import get_artifact, anomaly_inputs, SUPPLY_ITEMS
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+MAX_SAMPLES = 50_000
+DISTRIBUTIONS = ('uniform', 'normal')
+
+_PATIENT_SPLITS = weakref.WeakKeyDictionary()   # supply model -> sorted split thresholds on its patient input
+
+
+@lru_cache(maxsize=4)
+def _base_features_cached(json_path, mtime):
+    return build_features_for_prediction(json_path)
+
+
+def base_features(city=None, hospital_id=None, json_path=CONTEXT_FILE):
+    """
+    Prediction-ready department rows for one city / hospital: the feature store's latest hour
+    when the pipeline has published one, else built from the context snapshot (rebuilt only
+    when it changes). Returns an empty frame when neither has rows for that city.
+    """
+    df = FEATURE_STORE.latest_frame(city, hospital_id)
+    if not df.empty:
+        return df
+    if not os.path.exists(json_path):
+        return pd.DataFrame()
+    df = _base_features_cached(json_path, os.path.getmtime(json_path))
+    for col, value in (('city', city), ('hospital_id', hospital_id)):
+        if value is not None:
+            df = df[df[col] == value]
+    return df.reset_index(drop=True)
+
+
+def _draw(rng, spec, n):
+    """
+    Sample n values from a perturbation spec:
+      {"dist": "normal", "mean": .., "std": ..} or {"dist": "uniform", "low": .., "high": ..}
+    A missing spec means no perturbation.
+    """
+    if not spec:
+        return np.zeros(n)
+    dist = spec.get("dist", "uniform")
+    if dist not in DISTRIBUTIONS:
+        raise ValueError(f"unknown dist '{dist}', expected one of {DISTRIBUTIONS}")
+    if dist == "normal":
+        if spec.get("std", 0.0) < 0:
+            raise ValueError("std must be >= 0")
+        return rng.normal(spec.get("mean", 0.0), spec.get("std", 0.0), n)
+    if spec.get("low", 0.0) > spec.get("high", 0.0):
+        raise ValueError("low must be <= high")
+    return rng.uniform(spec.get("low", 0.0), spec.get("high", 0.0), n)
+
+
+def _patient_splits(model):
+    """Sorted thresholds a LightGBM supply model splits its first (patient) input on."""
+    splits = _PATIENT_SPLITS.get(model)
+    if splits is None:
+        trees = model.booster_.trees_to_dataframe()
+        patient = model.booster_.feature_name()[0]
+        splits = np.unique(trees.loc[trees['split_feature'] == patient, 'threshold'].to_numpy(dtype=np.float64))
+        _PATIENT_SPLITS[model] = splits
+    return splits
+
+
+def _predict_supply(model, patients, dow):
+    """
+    Supply model output for (patients, dow) rows. A tree only sees which side of each split a
+    value falls on, so rows are grouped by their interval between the patient thresholds and
+    the model runs once per distinct (interval, dow) pair: the same output from a few hundred
+    rows instead of samples × departments.
+    """
+    if not hasattr(model, 'booster_'):
+        return np.asarray(model.predict(pd.DataFrame({'patient_forecast': patients, 'dow': dow})))
+    splits = _patient_splits(model)
+    # interval i holds splits[i-1] < x <= splits[i]; splits[i] itself lands in it, and any
+    # value above the last threshold stands in for the open top interval
+    points = np.append(splits, splits[-1] + 1 if len(splits) else 0.0)
+    days, day_idx = np.unique(dow, return_inverse=True)
+    keys, inverse = np.unique(np.searchsorted(splits, patients) * len(days) + day_idx, return_inverse=True)
+    usage = model.predict(pd.DataFrame({'patient_forecast': points[keys // len(days)], 'dow': days[keys % len(days)]}))
+    return np.asarray(usage)[inverse]
+
+
+def _quantiles(values, axis=0):
+    q = np.quantile(values, QUANTILES, axis=axis)
+    return {f"p{int(round(p * 100)):02d}": q[i] for i, p in enumerate(QUANTILES)}
+
+
+def _floats(d):
+    return {k: float(v) for k, v in d.items()}
+
+
+def run_scenarios(base_df, n_samples=10_000, pm25_shift=None, temp_shift=None,
+                  festival_prob=None, epidemic_prob=None, seed=None):
+    """
+    Monte Carlo what-if over one set of department rows (`base_df`, one row per department).
+    Each sample applies one perturbation to every department; all samples × departments
+    form a single feature matrix so each model is called once.
+    """
+    t0 = time.perf_counter()
+    n = int(min(max(1, n_samples), MAX_SAMPLES))
+    rng = np.random.default_rng(seed)
+    d = len(base_df)
+    model, features = forecast_artifact()
+    col = {c: i for i, c in enumerate(features)}
+
+    X = np.tile(base_df[features].to_numpy(dtype=np.float64), (n, 1))
+
+    # environmental shifts, with pm10 / aqi derived the same way as the feature builder
+    pm25 = np.clip(X[:, col['pm25']] + np.repeat(_draw(rng, pm25_shift, n), d), 0, 500)
+    X[:, col['pm25']] = pm25
+    X[:, col['pm10']] = pm25 * 1.2
+    X[:, col['aqi']] = np.minimum(500, pm25 * 1.5).astype(int)
+    X[:, col['temperature_c']] += np.repeat(_draw(rng, temp_shift, n), d)
+
+    if festival_prob is not None:
+        flag = np.repeat(rng.random(n) < festival_prob, d)
+        X[:, col['festival_flag']] = flag
+        X[:, col['festival_intensity']] = np.where(flag, np.maximum(X[:, col['festival_intensity']], 1), 0)
+
+    trend = np.tile(base_df.get('epidemic_trend_score', pd.Series(0, index=base_df.index)).to_numpy(dtype=np.float64), n)
+    if epidemic_prob is not None:
+        flag = np.repeat(rng.random(n) < epidemic_prob, d)
+        X[:, col['epidemic_flag']] = flag
+        trend = np.where(flag, np.maximum(trend, 1), 0)
+
+    # forecast: one batched predict over n × d rows
+    preds = model.predict(pd.DataFrame(X, columns=features, copy=False))
+    per_dept = preds.reshape(n, d)
+    totals = per_dept.sum(axis=1)
+
+    # supply: one predict per item over the distinct split intervals of the forecasts
+    dow = np.tile(base_df['dow'].to_numpy(dtype=np.float64), n)
+    supplies = {}
+    for item in SUPPLY_ITEMS:
+        m = get_artifact(f'supply_{item}.pkl')
+        if m is None:
+            continue
+        usage = _predict_supply(m['model'], preds, dow).reshape(n, d).sum(axis=1)
+        supplies[item] = _floats(_quantiles(usage))
+
+    # anomaly: one batched predict; report the share of samples with any flagged department
+    # (skipped when the artifact needs an input we cannot build)
+    anomaly_probability = None
+    iso = get_artifact('iso_anom.pkl')
+    anom_in = iso and anomaly_inputs(iso['features'], {
+        'total_patients': preds,
+        'pm25': pm25,
+        'pm25_delta': pm25 - X[:, col['pm25_lag1']],
+        'ambulance_arrivals': (preds * 0.1).astype(int),
+        'epidemic_trend_score': trend,
+    })
+    if anom_in:
+        flagged = (iso['model'].predict(pd.DataFrame(anom_in)) == -1).reshape(n, d)
+        anomaly_probability = float(flagged.any(axis=1).mean())
+
+    dept_q = _quantiles(per_dept, axis=0)
+    departments = [
+        {"department": dept, **{k: float(v[j]) for k, v in dept_q.items()}}
+        for j, dept in enumerate(base_df['department'])
+    ]
+
+    return {
+        "n_samples": n,
+        "forecast": _floats(_quantiles(totals)),
+        "departments": departments,
+        "supplies": supplies,
+        "anomaly_probability": anomaly_probability,
+        "pm25": _floats(_quantiles(pm25.reshape(n, d)[:, 0])),
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+def _reference_rows():
+    """One neutral row per department, encoded with the shipped label encoders (for checks)."""
+    depts = list(get_artifact('labelenc_department.pkl').classes_)
+    hospital = 'HOSP_MUM_001'
+    df = pd.DataFrame({f: np.zeros(len(depts)) for f in forecast_artifact()[1]})
+    df['department'] = depts
+    df['hospital_id'] = hospital
+    df['dow'] = 2
+    df['hour'] = 12
+    df['epidemic_trend_score'] = 1
+    df['pm25'] = df['pm25_lag1'] = 120.0
+    df['tp_lag_1'] = df['tp_lag_24'] = df['rolling_3'] = df['rolling_7'] = 30.0
+    df['days_to_next_festival'] = 999
+    df['department_le'] = get_artifact('labelenc_department.pkl').transform(depts)
+    df['hospital_le'] = get_artifact('labelenc_hospital.pkl').transform([hospital] * len(depts))
+    return df
+
+
+if __name__ == "__main__":
+    # Check against the real models/*.pkl: every perturbation switched on, every model called
+    base = base_features(city='Mumbai')
+    if base.empty:
+        print("ℹ️  No stored features or context snapshot; using reference department rows")
+        base = _reference_rows()
+    result = run_scenarios(base, n_samples=10_000,
+                           pm25_shift={"dist": "uniform", "low": 50, "high": 120},
+                           temp_shift={"dist": "normal", "mean": 0, "std": 1.5},
+                           festival_prob=0.3, epidemic_prob=0.5, seed=7)
+    print(f"🎲 {result['n_samples']} samples in {result['elapsed_ms']} ms")
+    print("Forecast quantiles:", result["forecast"])
+    print("Supplies:", sorted(result["supplies"]))
+    print("Anomaly probability:", result["anomaly_probability"])
+    assert len(result["departments"]) == len(base)
+    assert np.isfinite(list(result["forecast"].values())).all()
+    assert set(result["supplies"]) == {i for i in SUPPLY_ITEMS if get_artifact(f'supply_{i}.pkl')}
+    assert result["anomaly_probability"] is not None, "iso_anom.pkl inputs could not be built"
+    print("✅ Scenario engine check passed")
@@ -0,0 +1,180 @@
+"""
+state_snapshot.py
+Copy-on-write API state: immutable rows and snapshots published atomically as new versions.
+Readers grab `store.current` (a single reference read) and never lock; writers serialise
+among themselves, build a new snapshot and swap it in.
+"""
+import threading
+from datetime import datetime
+
+
+class FrozenRow:
+    """Immutable record with __slots__; subclasses list their fields in __slots__."""
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for k in self.__slots__:
+            object.__setattr__(self, k, values.get(k))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable; use replace()")
+
+    def replace(self, **changes):
+        values = self.to_dict()
+        values.update(changes)
+        return type(self)(**values)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+class InsightRow(FrozenRow):
+    __slots__ = ("timestamp", "area_id", "area_name", "pm25", "surge_risk", "expected_patients_hr", "oxygen_extra")
+
+
+class Snapshot:
+    """One consistent, immutable version of the API state."""
+    __slots__ = ("version", "last_update", "insights")
+
+    def __init__(self, version=0, last_update=None, insights=()):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "last_update", last_update)
+        object.__setattr__(self, "insights", tuple(insights))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Snapshot is immutable; publish a new one via SnapshotStore.update()")
+
+    def evolve(self, **changes):
+        """New snapshot (next version) sharing every field that is not changed."""
+        values = {k: getattr(self, k) for k in self.__slots__}
+        values.update(changes)
+        values["version"] = self.version + 1
+        return Snapshot(**values)
+
+    def map_area(self, area_id, fn):
+        """New insights tuple with `fn(row)` applied to the rows of one area."""
+        return tuple(fn(r) if r.area_id == area_id else r for r in self.insights)
+
+
+class SnapshotStore:
+    """Holds the current Snapshot; `update` is the only way to change it."""
+
+    def __init__(self, snapshot=None):
+        self._write_lock = threading.Lock()
+        self.current = snapshot or Snapshot()
+
+    def update(self, fn):
+        """Apply `fn(snapshot) -> snapshot` and publish the result atomically; returns it."""
+        with self._write_lock:
+            new = fn(self.current)
+            self.current = new
+        return new
+
+
+def utc_now():
+    return datetime.utcnow().isoformat()+"Z"
+
+
+if __name__ == "__main__":
+    # Concurrency stress check through the real API writers in main.py: post_action,
+    # simulate_area and refresh_state publish snapshots while get_insights reads them. Every
+    # read must list each area once, pass the Insight model and carry the row timestamps of one
+    # single refresh (actions and simulations change rows but never their timestamp); every
+    # accepted action must be in the journal, and every write must publish exactly one version
+    # (none lost to a racing writer). Journal / history / latest files go to a temp directory.
+    import os
+    import sys
+    import time
+    import random
+    import tempfile
+    import warnings
+    from functools import partial
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    warnings.filterwarnings("ignore")
+    import main
+    from pipeline.action_journal import ActionJournal
+
+    tmp = tempfile.mkdtemp()
+    main.JOURNAL = ActionJournal(os.path.join(tmp, "actions.jsonl"))
+    main.INSIGHTS_LATEST = os.path.join(tmp, "insights_latest.json")
+    main.append_insights = partial(main.append_insights, path=os.path.join(tmp, "insights_history.csv"))
+    refreshes = set()   # row timestamps of every refresh, recorded as it is published
+
+    def publish_latest(rows, last_update, publish=partial(main.publish_latest, path=main.INSIGHTS_LATEST)):
+        refreshes.add(tuple(r["timestamp"] for r in rows))
+        publish(rows, last_update)
+
+    main.publish_latest = publish_latest
+    main.refresh_state()
+    start_version = main.STATE.current.version
+
+    area_ids = [a["area_id"] for a in main.AREAS]
+    scenario = main.ScenarioRequest(n_samples=200, seed=1)
+    stop = threading.Event()
+    errors = []
+    counts = {"reads": 0, "refresh": 0, "action": 0, "simulate": 0}
+    accepted = []
+    observed = set()
+
+    def run_writer(name, call):
+        while not stop.is_set():
+            try:
+                call()
+            except Exception as e:  # a writer crashing is a failure too
+                errors.append(f"{name} raised {e!r}")
+                return
+            counts[name] += 1
+
+    def post_action():
+        res = main.post_action(main.ActionRequest(area_id=random.choice(area_ids), action_type="dispatch",
+                                                  details={"nurses": 2}))
+        accepted.append(res["action_id"])
+
+    def reader():
+        last = -1
+        while not stop.is_set():
+            version = main.STATE.current.version
+            rows = main.get_insights()
+            if version < last:
+                errors.append(f"version went backwards {last} -> {version}")
+            last = version
+            if sorted(r["area_id"] for r in rows) != sorted(area_ids):
+                errors.append(f"areas missing or repeated near v{version}")
+            # a read may land before its refresh is recorded, so these are checked at the end
+            observed.add(tuple(r["timestamp"] for r in rows))
+            for r in rows:
+                try:
+                    main.Insight(**r)
+                except ValueError as e:
+                    errors.append(f"invalid row near v{version}: {e}")
+            counts["reads"] += 1
+
+    writers = [("refresh", main.refresh_state), ("action", post_action), ("action", post_action),
+               ("simulate", lambda: main.simulate_area(random.choice(area_ids), scenario))]
+    threads = ([threading.Thread(target=run_writer, args=w) for w in writers]
+               + [threading.Thread(target=reader) for _ in range(6)])
+    for t in threads:
+        t.start()
+    time.sleep(5)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    writes = counts["refresh"] + counts["action"] + counts["simulate"]
+    if main.STATE.current.version != start_version + writes:
+        errors.append(f"{writes} writes published {main.STATE.current.version - start_version} versions")
+    mixed = observed - refreshes
+    if mixed:
+        errors.append(f"{len(mixed)} reads mix rows of different refreshes")
+    journaled = [a["id"] for a in main.JOURNAL.replay(tail=len(accepted) + 1)]
+    if sorted(journaled) != sorted(accepted) or len(set(accepted)) != len(accepted):
+        errors.append(f"{len(accepted)} actions accepted, {len(journaled)} journaled")
+    print(f"versions published: {main.STATE.current.version}, writes: "
+          f"{ {k: v for k, v in counts.items() if k != 'reads'} }, insight reads: {counts['reads']}")
+    if errors:
+        raise SystemExit(f"❌ {len(errors)} inconsistent reads / writes, e.g. {errors[0]}")
+    print("✅ No inconsistent reads.")